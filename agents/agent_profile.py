@@ -0,0 +1,81 @@
+import os
+from relevance_model import SKIP_BELOW
+from source_stats import STATS_FILE_PATH
+
+# --- Defaults (the original single-listener setup) ---
+DEFAULT_NAME = "default"
+DEFAULT_DATA_DIR = 'data'
+DEFAULT_CACHE_DIR = '.cache'
+DEFAULT_PROMPT_PATH = 'config/analyzer_prompt.txt'
+DEFAULT_TIDAL_ENV_PREFIX = "TIDAL_"
+DEFAULT_PLAYLIST_NAME = "AI Music Discovery"
+DEFAULT_MAX_LIKED_ALBUMS_PER_RUN = 5
+DEFAULT_FUZZY_MATCH_THRESHOLD = 85
+DEFAULT_MIN_RELEVANCE_SCORE = 0     # albums scored below this are dropped (0 = trust the prompt's own cut-off)
+TIDAL_ENV_KEYS = ("TOKEN_TYPE", "ACCESS_TOKEN", "REFRESH_TOKEN", "EXPIRY_TIME")
+
+# --- Profile ---
+class Profile:
+    """
+    One listener: their prompt, Tidal account, playlist and thresholds, and where their state lives.
+    The stages take it as an argument (Profile() is the original setup in data/), so several
+    profiles can run side by side, in one process or several.
+    """
+    def __init__(self, name=DEFAULT_NAME, data_dir=DEFAULT_DATA_DIR, cache_dir=DEFAULT_CACHE_DIR,
+                 prompt=DEFAULT_PROMPT_PATH, tidal_env_prefix=DEFAULT_TIDAL_ENV_PREFIX,
+                 playlist_name=DEFAULT_PLAYLIST_NAME, max_liked_albums_per_run=DEFAULT_MAX_LIKED_ALBUMS_PER_RUN,
+                 fuzzy_match_threshold=DEFAULT_FUZZY_MATCH_THRESHOLD, min_relevance_score=DEFAULT_MIN_RELEVANCE_SCORE,
+                 gate_skip_below=SKIP_BELOW, stats_path=STATS_FILE_PATH):
+        self.name = name
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.prompt = prompt
+        self.tidal_env_prefix = tidal_env_prefix
+        self.playlist_name = playlist_name
+        self.max_liked_albums_per_run = max_liked_albums_per_run
+        self.fuzzy_match_threshold = fuzzy_match_threshold
+        self.min_relevance_score = min_relevance_score
+        self.gate_skip_below = gate_skip_below
+        self.stats_path = stats_path  # where the analysis and Tidal stages record source yields (default: the shared stats)
+
+    # Everything the profile learns or decides lives in its data_dir
+    @property
+    def filtered_list_path(self):
+        return os.path.join(self.data_dir, 'filtered_album_list.json')
+
+    @property
+    def processed_log_path(self):
+        return os.path.join(self.data_dir, 'processed_albums.json')
+
+    @property
+    def run_log_path(self):
+        return os.path.join(self.data_dir, 'run_log.txt')
+
+    @property
+    def report_path(self):
+        return os.path.join(self.data_dir, 'index.html')
+
+    @property
+    def reconcile_report_path(self):
+        return os.path.join(self.data_dir, 'reconcile_report.json')
+
+    @property
+    def library_index_path(self):
+        return os.path.join(self.data_dir, 'library_index.json')
+
+    @property
+    def model_path(self):
+        return os.path.join(self.data_dir, 'relevance_model.json')
+
+    @property
+    def usage_path(self):
+        return os.path.join(self.data_dir, 'llm_usage.json')
+
+    # ...except scratch state that is rewritten every run and not committed
+    @property
+    def replay_path(self):
+        return os.path.join(self.cache_dir, 'relevance_replay.json')
+
+    def tidal_credentials(self):
+        """(token_type, access_token, refresh_token, expiry_time) from <tidal_env_prefix>*; missing ones are None."""
+        return tuple(os.getenv(f"{self.tidal_env_prefix}{key}") for key in TIDAL_ENV_KEYS)
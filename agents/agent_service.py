@@ -0,0 +1,178 @@
+import hmac
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+import cleanup_agent
+import tidal_agent
+from library_index import save_library_index
+from agent_profile import Profile
+from processed_log import save_history
+
+# --- Configuration ---
+SERVICE_HOST = '127.0.0.1'  # local only; put a reverse proxy in front to reach it from elsewhere
+SERVICE_PORT = int(os.getenv("MUSIC_AGENT_PORT", "8765"))
+SERVICE_TOKEN = os.getenv("MUSIC_AGENT_TOKEN")  # if set, requests must send it as X-Agent-Token
+WORKFLOW_INTERVAL_HOURS = float(os.getenv("MUSIC_AGENT_WORKFLOW_HOURS", "56"))  # run_agent.yml runs ~3x a week
+CLEANUP_INTERVAL_HOURS = float(os.getenv("MUSIC_AGENT_CLEANUP_HOURS", "24"))    # run_daily_cleanup.yml
+HISTORY_FLUSH_SECONDS = 60  # HITL commands change the history in memory; it is written out at most this late
+VALID_ACTIONS = ("REMOVE", "PROMOTE")
+MAX_BODY_BYTES = 10_000
+
+# --- Service ---
+class AgentService:
+    """
+    Keeps one authenticated Tidal session, the library index, the history and an HTTP pool in memory, runs the workflow and playlist sweep on a schedule, and handles
+    HITL commands (the cleanup_trigger.yml inputs) without a cold start.
+    Tidal-touching work and every relevance model save are serialized by tidal_lock; harvest and
+    analysis run outside it, so a HITL command never waits for the 60s LLM throttles.
+    """
+    def __init__(self, run_workflow, profile=None):
+        self.run_workflow = run_workflow
+        self.profile = profile or Profile()
+        self.tidal_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.http = requests.Session()
+        self.cleanup_client = cleanup_agent.RealTidalClient(profile=self.profile)
+        self.tidal_client = tidal_agent.RealTidalClient(self.cleanup_client.session, self.cleanup_client.library_index,
+                                                        self.profile, self.cleanup_client.history)
+        self.history_dirty = False  # HITL changes not yet written to processed_albums.json
+        self.status = {"started": time.time(), "last_workflow": None, "last_cleanup": None,
+                       "next_workflow": None, "next_cleanup": None, "commands": 0, "last_command": None}
+
+    def _rewarm(self):
+        """Per job: drop playlist objects from the last run (their track counts and timestamps go stale)."""
+        self.tidal_client.reset_playlist_cache()
+
+    def flush_history(self):
+        """Writes HITL history changes, if any. Call with tidal_lock held."""
+        if self.history_dirty:
+            save_history(self.cleanup_client.history, self.profile.processed_log_path)
+            self.history_dirty = False
+
+    def run_workflow_job(self):
+        print(f"AgentService: Scheduled workflow run at {time.ctime()}")
+        self.run_workflow(tidal_client=self.tidal_client, cleanup_client=self.cleanup_client,
+                          http=self.http, tidal_lock=self.tidal_lock, before_tidal=self._rewarm, profile=self.profile)
+        self.status['last_workflow'] = time.time()
+
+    def run_cleanup_job(self):
+        print(f"AgentService: Scheduled playlist cleanup at {time.ctime()}")
+        with self.tidal_lock:
+            self._rewarm()
+            cleanup_agent.process_commands(self.cleanup_client)
+        self.status['last_cleanup'] = time.time()
+
+    def handle_command(self, album_id, action, artist=None, album=None):
+        """One REMOVE/PROMOTE, same semantics as cleanup_trigger.yml. Returns elapsed ms."""
+        started = time.perf_counter()
+        with self.tidal_lock:
+            self._rewarm()
+            cleanup_agent.process_direct_command(self.cleanup_client, album_id, action, artist, album, write_history=False)
+            self.history_dirty = True
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.status['commands'] += 1
+        self.status['last_command'] = {"album_id": album_id, "action": action, "elapsed_ms": elapsed_ms, "at": time.time()}
+        return elapsed_ms
+
+    def schedule_loop(self, run_now=False):
+        now = time.time()
+        next_workflow = now if run_now else now + WORKFLOW_INTERVAL_HOURS * 3600
+        next_cleanup = now + CLEANUP_INTERVAL_HOURS * 3600
+        while not self.stop_event.is_set():
+            self.status.update(next_workflow=next_workflow, next_cleanup=next_cleanup)
+            now = time.time()
+            try:
+                if now >= next_workflow:
+                    self.run_workflow_job()
+                    next_workflow = time.time() + WORKFLOW_INTERVAL_HOURS * 3600
+                    continue
+                if now >= next_cleanup:
+                    self.run_cleanup_job()
+                    next_cleanup = time.time() + CLEANUP_INTERVAL_HOURS * 3600
+                    continue
+            except Exception as e:
+                # A failed job must not kill the service; it is retried at its next slot
+                print(f"AgentService: Scheduled job failed: {e}")
+                next_workflow = max(next_workflow, time.time() + 3600)
+                next_cleanup = max(next_cleanup, time.time() + 3600)
+            with self.tidal_lock:
+                self.flush_history()
+            self.stop_event.wait(min(next_workflow, next_cleanup, time.time() + HISTORY_FLUSH_SECONDS) - time.time())
+
+    def stop(self):
+        self.stop_event.set()
+        with self.tidal_lock:
+            self.flush_history()
+            save_library_index(self.cleanup_client.library_index, self.profile.library_index_path)
+
+# --- HTTP Endpoint ---
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        return not SERVICE_TOKEN or hmac.compare_digest(self.headers.get('X-Agent-Token', ''), SERVICE_TOKEN)
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self._reply(404, {"error": "not found"})
+        if not self._authorized():
+            return self._reply(401, {"error": "unauthorized"})
+        self._reply(200, self.service.status)
+
+    def do_POST(self):
+        if self.path != '/cleanup':
+            return self._reply(404, {"error": "not found"})
+        if not self._authorized():
+            return self._reply(401, {"error": "unauthorized"})
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            return self._reply(413, {"error": "body too large"})
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            return self._reply(400, {"error": "body must be JSON"})
+        # Same inputs as the cleanup_trigger.yml workflow_dispatch form
+        album_id = str(data.get('album_id') or '').strip()
+        action = str(data.get('action_type') or data.get('action') or 'REMOVE').upper()
+        if not album_id or action not in VALID_ACTIONS:
+            return self._reply(400, {"error": f"album_id is required and action_type must be one of {', '.join(VALID_ACTIONS)}"})
+        try:
+            elapsed_ms = self.service.handle_command(album_id, action, data.get('artist'), data.get('album'))
+        except Exception as e:
+            return self._reply(500, {"error": str(e)})
+        self._reply(200, {"status": "ok", "album_id": album_id, "action": action, "elapsed_ms": elapsed_ms})
+
+    def log_message(self, format, *args):
+        print(f"AgentService: {self.address_string()} {format % args}")
+
+def start_server(service, host=SERVICE_HOST, port=SERVICE_PORT, poll_interval=0.5):
+    """Starts the endpoint in a background thread. Returns the server (server_address has the bound port)."""
+    handler = type('AgentServiceHandler', (_Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, args=(poll_interval,), daemon=True).start()
+    return server
+
+def serve(run_workflow, port=SERVICE_PORT, run_now=False):
+    """Runs the service until interrupted."""
+    service = AgentService(run_workflow)
+    server = start_server(service, port=port)
+    print(f"AgentService: Listening on http://{SERVICE_HOST}:{server.server_address[1]} "
+          f"(POST /cleanup, GET /status). Workflow every {WORKFLOW_INTERVAL_HOURS}h, cleanup every {CLEANUP_INTERVAL_HOURS}h.")
+    try:
+        service.schedule_loop(run_now=run_now)
+    except KeyboardInterrupt:
+        print("\nAgentService: Shutting down...")
+    finally:
+        service.stop()
+        server.shutdown()
@@ -1,14 +1,21 @@
+import contextlib
 import json
 import os
 import time
 import google.generativeai as genai
 from dotenv import load_dotenv
+from tracing import span
+from llm_usage import RunUsage, estimate_tokens, save_run_usage, MAX_TOKENS_PER_RUN, MAX_REQUESTS_PER_RUN
+from source_stats import load_source_stats, save_source_stats, record_analysis, load_source_priorities
+from relevance_model import RelevanceGate, load_model
+from snapshot_store import page_text as load_page_text, write_handoff, record_run
+from structured_output import AlbumStreamParser
+from agent_profile import Profile
 
 # --- Configuration ---
-INPUT_FILE_PATH = 'data/raw_album_list.json'
-OUTPUT_FILE_PATH = 'data/filtered_album_list.json'
-PROMPT_FILE_PATH = 'config/analyzer_prompt.txt'
-OUTPUT_DIR = 'data'
+INPUT_FILE_PATH = 'data/raw_album_list.json'  # shared harvest; the prompt and output are per profile
+# A safe limit for gemini-pro is ~30k, but let's be safer for the prompt
+MAX_PAGE_CHARS = 25000
 
 # --- Load API Key and Configure AI ---
 load_dotenv(dotenv_path='config/.env')
@@ -20,20 +27,31 @@ else:
     genai.configure(api_key=API_KEY)
 
 # --- REAL Google AI API Call ---
-def get_ai_analysis(page_text, source_name, system_prompt):
+def _chunk_text(chunk):
+    # The SDK raises on chunks without text parts (e.g. the last one of a blocked or cut-off answer)
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def get_ai_analysis(page_text, source_name, system_prompt, run_usage=None, on_album=None):
     """
     This function sends the ENTIRE page text to the AI for
-    finding AND analyzing albums.
+    finding AND analyzing albums. Token usage is added to run_usage if given.
+    The response is streamed: each album is validated as soon as its object closes and passed
+    to on_album right away, and a truncated or broken answer still returns every complete album.
     """
     print(f"  > [AI] Analyzing page: {source_name} ({len(page_text)} chars)")
     
     # Truncate text if it's too long for the model's context window
-    # A safe limit for gemini-pro is ~30k, but let's be safer for the prompt
-    max_chars = 25000 
-    if len(page_text) > max_chars:
-        print(f"  > [AI] Page text is too long. Truncating to {max_chars} chars.")
-        page_text = page_text[:max_chars]
+    if len(page_text) > MAX_PAGE_CHARS:
+        print(f"  > [AI] Page text is too long. Truncating to {MAX_PAGE_CHARS} chars.")
+        page_text = page_text[:MAX_PAGE_CHARS]
 
+    if run_usage is None:
+        run_usage = RunUsage("analysis")
+    parser = AlbumStreamParser()
+    analysis_list = []
     try:
         model = genai.GenerativeModel(
             'gemini-2.5-flash',
@@ -42,31 +60,65 @@ def get_ai_analysis(page_text, source_name, system_prompt):
             # safety_settings={'HARASSMENT': 'BLOCK_NONE'} 
         )
         
-        response = model.generate_content(page_text)
-        
-        json_text = response.text.strip().replace("```json", "").replace("```", "")
-        
-        analysis_list = json.loads(json_text)
-        return analysis_list
+        with span("llm.generate_content", "llm", source=source_name, chars=len(page_text)) as s:
+            started = time.perf_counter()
+            usage_source = None
+            output_chars = 0
+            answered = False
+            try:
+                response = model.generate_content(page_text, stream=True)
+                usage_source = response  # the SDK totals usage on the response; chunks carry it too (last one wins)
+                for chunk in response:
+                    answered = True
+                    if getattr(chunk, 'usage_metadata', None):
+                        usage_source = chunk
+                    text = _chunk_text(chunk)
+                    output_chars += len(text)
+                    for album in parser.feed(text):
+                        if not analysis_list:
+                            s.set(first_album_ms=round((time.perf_counter() - started) * 1000, 1))
+                        analysis_list.append(album)
+                        if on_album:
+                            on_album(album)
+                answered = True
+            finally:
+                if answered:
+                    # Counted even if the stream broke off later: Gemini processed the request
+                    input_tokens, output_tokens = run_usage.record(source_name, usage_source, estimate_tokens(system_prompt, page_text))
+                else:
+                    # Rejected before any output (quota, auth, network): not a call the budget paid for
+                    run_usage.record_failure(source_name)
+                    input_tokens = output_tokens = 0
+                s.set(output_chars=output_chars, input_tokens=input_tokens, output_tokens=output_tokens,
+                      albums=len(analysis_list), invalid=len(parser.invalid))
 
-    except json.JSONDecodeError:
-        print(f"  > [AI Error] Failed to decode JSON list from AI response: {response.text}")
-        return []
     except Exception as e:
         print(f"  > [AI Error] An error occurred: {e}")
-        return []
+        if analysis_list:
+            print(f"  > [AI] Salvaged {len(analysis_list)} complete albums received before the error.")
+
+    for reason in parser.invalid:
+        print(f"  > [AI] Dropped invalid record: {reason}")
+    if parser.truncated:
+        print(f"  > [AI] Response ended mid-list; kept the {len(analysis_list)} complete albums.")
+    return analysis_list
 
 # --- Main Function ---
-def analyze_albums():
+def analyze_albums(on_album=None, profile=None, model_lock=None):
+    """
+    on_album, if given, receives each approved album (with its source_name) the moment it is parsed.
+    model_lock, if given, is held while the relevance model is updated and saved.
+    """
     print("AnalysisAgent: Starting run (AI-Parser Mode)...")
+    profile = profile or Profile()
     
     # 1. Load the system prompt
     try:
-        with open(PROMPT_FILE_PATH, 'r') as f:
+        with open(profile.prompt, 'r') as f:
             system_prompt = f.read()
         print("Successfully loaded AI prompt.")
     except FileNotFoundError:
-        print(f"Error: Prompt file not found at {PROMPT_FILE_PATH}")
+        print(f"Error: Prompt file not found at {profile.prompt}")
         return
 
     # 2. Load the raw pages list
@@ -82,26 +134,65 @@ def analyze_albums():
         print("No raw pages found. Exiting analysis.")
         return # <-- Added a 'return' here to stop if no pages
         
+    # Highest expected-yield sources go first, so a budget cut only ever drops the least valuable pages
+    source_priority = load_source_priorities()
+    raw_pages.sort(key=lambda p: source_priority.get(p['source_name'], 0), reverse=True)
+    run_usage = RunUsage("analysis", MAX_TOKENS_PER_RUN, MAX_REQUESTS_PER_RUN)
+    print(f"  > LLM budget: {MAX_TOKENS_PER_RUN or 'unlimited'} tokens, {MAX_REQUESTS_PER_RUN or 'unlimited'} requests.")
+
     # 3. Analyze each page
     
     # --- THIS IS THE NEW FIX ---
     print("  > Waiting 60s for free tier to cool down before first call...")
-    time.sleep(60)
+    with span("llm.rate_limit_wait", "wait", seconds=60):
+        time.sleep(60)
     # --- END NEW FIX ---
     
+    source_stats = load_source_stats(profile.stats_path)
+    # Local first-tier filter: page chunks it is confident are irrelevant never reach Gemini
+    gate = RelevanceGate(load_model(profile.model_path), profile.gate_skip_below, profile.model_path, profile.replay_path)
+    print(f"  > Relevance filter: {gate.mode}{'' if gate.mode == 'active' else ' (all chunks go to Gemini)'}.")
     all_approved_albums = []
     for page in raw_pages:
-        if not page.get('page_text'):
+        full_text = load_page_text(page)
+        if not full_text:
             print(f"  > Skipping {page['source_name']}, no text found.")
             continue
 
-        approved_albums_from_page = get_ai_analysis(
-            page['page_text'], 
+        page_text, chunks = gate.filter_page(full_text, page['source_name'], MAX_PAGE_CHARS)
+        if not page_text:
+            print(f"  > [Filter] Skipping {page['source_name']}: no chunk scored as relevant.")
+            continue
+
+        estimated = estimate_tokens(system_prompt, page_text)
+        if not run_usage.can_afford(estimated):
+            print(f"  > [Budget] Deferring {page['source_name']} (~{estimated} tokens): run budget exhausted.")
+            run_usage.defer(page['source_name'], f"~{estimated} tokens over budget")
+            continue
+
+        approved_albums_from_page = []
+
+        def forward(album, source_name=page['source_name']):
+            if profile.min_relevance_score and album['relevance_score'] < profile.min_relevance_score:
+                return
+            # Keep the source on each album so the Tidal stage can credit matches back to it
+            album['source_name'] = source_name
+            approved_albums_from_page.append(album)
+            if on_album:
+                on_album(album)
+
+        parsed_albums = get_ai_analysis(
+            page_text, 
             page['source_name'], 
-            system_prompt
+            system_prompt,
+            run_usage,
+            on_album=forward
         )
+        gate.observe(chunks, parsed_albums)
         
+        record_analysis(source_stats, page['source_name'], len(approved_albums_from_page))
         if approved_albums_from_page:
+            run_usage.record_albums(page['source_name'], len(approved_albums_from_page))
             print(f"  > [AI] Found {len(approved_albums_from_page)} approved albums on {page['source_name']}.")
             all_approved_albums.extend(approved_albums_from_page)
         else:
@@ -109,15 +200,28 @@ def analyze_albums():
 
         # This delay protects all calls *after* the first one
         print("  > Waiting 60s to respect free tier rate limit...")
-        time.sleep(60)
+        with span("llm.rate_limit_wait", "wait", seconds=60):
+            time.sleep(60)
 
     # 4. Save the combined list of all approved albums
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    with open(OUTPUT_FILE_PATH, 'w') as f:
-        json.dump(all_approved_albums, f, indent=2)
+    os.makedirs(profile.data_dir, exist_ok=True)
+    with span("analysis.save", "io", albums=len(all_approved_albums)):
+        ref = write_handoff(profile.filtered_list_path, "filtered_album_list", all_approved_albums, albums=len(all_approved_albums))
+    record_run("analysis", {"filtered_album_list": ref})
+        
+    save_run_usage(run_usage, profile.usage_path)
+    save_source_stats(source_stats, profile.stats_path)
+    with model_lock or contextlib.nullcontext():
+        gate_stats = gate.finish()
+    print(f"  > Relevance filter: skipped {gate_stats['pages_skipped']} pages and {gate_stats['chunks_skipped']} of "
+          f"{gate_stats['chunks']} chunks (would skip {gate_stats['would_skip']}, {gate_stats['would_skip_misses']} of "
+          f"{gate_stats['would_skip_checked']} checked had albums); agreement with Gemini: "
+          f"{gate_stats['agreement'] if gate_stats['agreement'] is not None else 'n/a'}.")
+    if run_usage.deferred:
+        print(f"  > Deferred {len(run_usage.deferred)} low-priority pages to stay within the LLM budget.")
         
     print(f"\nAnalysisAgent: Run complete. Approved {len(all_approved_albums)} total albums.")
-    print(f"Results saved to {OUTPUT_FILE_PATH}")
+    print(f"Results saved to {profile.filtered_list_path}")
 
 # --- Run the script ---
 if __name__ == "__main__":
@@ -1,24 +1,33 @@
-import json
 import os
 import time
 from dotenv import load_dotenv
 from tidalapi import Session, UserPlaylist
+from tracing import span
+from library_index import (load_library_index, save_library_index, remember_playlist, cached_playlist,
+                           playlist_album_tracks, forget_playlist_album, record_favorite)
+from relevance_model import load_model, save_model, record_feedback
+from agent_profile import Profile
+from processed_log import load_history, save_history
 
 # --- Configuration ---
-DISCOVERY_PLAYLIST = "AI Music Discovery"
+# The discovery playlist and history file come from the client's Profile
 REMOVE_CMD_PLAYLIST = "[Agent] Remove"
 PROMOTE_CMD_PLAYLIST = "[Agent] Promote"
-PROCESSED_LOG_PATH = 'data/processed_albums.json'
 
 # --- Tidal Client ---
 class RealTidalClient:
-    def __init__(self):
+    def __init__(self, session=None, library_index=None, profile=None, history=None):
+        self.profile = profile or Profile()
+        # A long-running service passes in its already-authenticated session, shared index and history
+        if session is not None:
+            self.session = session
+            self.user = session.user
+            self.library_index = library_index if library_index is not None else load_library_index(self.profile.library_index_path)
+            self.history = history if history is not None else load_history(self.profile.processed_log_path)
+            return
         self.session = Session()
         load_dotenv(dotenv_path='config/.env') 
-        token_type = os.getenv("TIDAL_TOKEN_TYPE")
-        access_token = os.getenv("TIDAL_ACCESS_TOKEN")
-        refresh_token = os.getenv("TIDAL_REFRESH_TOKEN")
-        expiry_time = os.getenv("TIDAL_EXPIRY_TIME")
+        token_type, access_token, refresh_token, expiry_time = self.profile.tidal_credentials()
         
         if not all([token_type, access_token, refresh_token, expiry_time]):
             print("Error: Tidal auth tokens not found.")
@@ -36,24 +45,28 @@ class RealTidalClient:
         except Exception as e:
             print(f"Failed to authenticate: {e}")
             raise
+        self.library_index = load_library_index(self.profile.library_index_path)
+        self.history = load_history(self.profile.processed_log_path)
 
     def get_or_create_playlist(self, name, description=""):
-        """Finds a playlist or creates it if missing."""
+        """Finds a playlist (by cached id first) or creates it if missing."""
+        playlist = cached_playlist(self.session, self.library_index, name)
+        if playlist is not None:
+            return playlist
+
         for pl in self.session.user.playlists():
             if pl.name == name:
+                remember_playlist(self.library_index, name, pl.id)
                 return pl
         
         print(f"  > Playlist '{name}' not found. Creating it...")
-        return self.session.user.create_playlist(name, description)
+        playlist = self.session.user.create_playlist(name, description)
+        remember_playlist(self.library_index, name, playlist.id)
+        return playlist
 
 # --- Log Management ---
-def update_processed_log(artist, album, status):
-    try:
-        with open(PROCESSED_LOG_PATH, 'r') as f:
-            processed_albums = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        processed_albums = []
-
+def update_processed_log(processed_albums, artist, album, status, album_id=None):
+    """Updates the in-memory history; the caller writes it with save_history()."""
     unique_key = f"{artist}::{album}"
     
     # Check if entry exists
@@ -62,6 +75,8 @@ def update_processed_log(artist, album, status):
         if item['key'] == unique_key:
             item['action'] = status 
             item['timestamp'] = time.time()
+            if album_id is not None:
+                item['album_id'] = str(album_id)
             found = True
             break
             
@@ -71,24 +86,44 @@ def update_processed_log(artist, album, status):
             "artist": artist,
             "album": album,
             "timestamp": time.time(),
-            "action": status
+            "action": status,
+            "album_id": str(album_id) if album_id is not None else None
         })
         
-    with open(PROCESSED_LOG_PATH, 'w') as f:
-        json.dump(processed_albums, f, indent=2)
     print(f"  > Log updated: '{album}' -> {status}")
 
 # --- Core Logic ---
-def process_commands():
+def process_commands(client=None, profile=None):
+    """Sweeps the command playlists. A passed-in client brings its own profile."""
+    # HITL button (cleanup_trigger.yml): act on exactly one album instead of sweeping the playlists
+    direct_album_id = os.getenv("CLEANUP_ALBUM_ID")
+    if direct_album_id and client is None:
+        try:
+            client = RealTidalClient(profile=profile)
+        except Exception:
+            return
+        process_direct_command(
+            client,
+            direct_album_id,
+            os.getenv("CLEANUP_ACTION", "REMOVE").upper(),
+            os.getenv("CLEANUP_ARTIST"),
+            os.getenv("CLEANUP_ALBUM"),
+        )
+        return
+
     print("CleanupAgent: Checking for commands in Tidal playlists...")
     
-    try:
-        client = RealTidalClient()
-    except Exception:
-        return
+    if client is None:
+        try:
+            client = RealTidalClient(profile=profile)
+        except Exception:
+            return
+    profile = client.profile
+    # Loaded per call, not per client: a long-lived client must see the Tidal stage's pending albums
+    client.relevance_model = load_model(profile.model_path)
 
     # 1. Get all necessary playlists
-    discovery_pl = client.get_or_create_playlist(DISCOVERY_PLAYLIST)
+    discovery_pl = client.get_or_create_playlist(profile.playlist_name)
     remove_pl = client.get_or_create_playlist(REMOVE_CMD_PLAYLIST, "Add tracks here to remove their album from Discovery.")
     promote_pl = client.get_or_create_playlist(PROMOTE_CMD_PLAYLIST, "Add tracks here to Like the album and remove from Discovery.")
     
@@ -98,11 +133,78 @@ def process_commands():
     # 3. Process "PROMOTE" Commands
     process_queue(client, promote_pl, discovery_pl, action="PROMOTE")
 
+    save_history(client.history, profile.processed_log_path)
+    save_library_index(client.library_index, profile.library_index_path)
+    save_model(client.relevance_model, profile.model_path)
     print("CleanupAgent: All commands processed.")
 
+def process_direct_command(client, album_id, action, artist=None, album=None, write_history=True):
+    """
+    Likes (PROMOTE) or excludes (REMOVE) a single album and removes its tracks from
+    the discovery playlist. With the album in the library index this is a handful
+    of API calls: one playlist lookup, one track read + one batch removal, plus the like.
+    write_history=False leaves client.history changed in memory only (the daemon writes it in batches).
+    """
+    print(f"CleanupAgent: Direct command {action} for album {album_id}...")
+    index = client.library_index
+    profile = client.profile
+    playlist_name = profile.playlist_name
+    client.relevance_model = load_model(profile.model_path)
+
+    if not artist or not album:
+        tidal_album = client.session.album(album_id)
+        artist = artist or (tidal_album.artist.name if tidal_album.artist else "Unknown")
+        album = album or tidal_album.name
+
+    if action == "PROMOTE":
+        print(f"  > Liking album on Tidal...")
+        with span("tidal.like_album", "tidal", album_id=str(album_id)):
+            client.session.user.favorites.add_album(album_id)
+        record_favorite(index, album_id, artist, album)
+        log_status = "LIKED_VIA_PLAYLIST"
+    else:
+        log_status = "EXCLUDED_VIA_PLAYLIST"
+
+    discovery_pl = client.get_or_create_playlist(playlist_name)
+    track_ids = playlist_album_tracks(index, playlist_name, album_id)
+    if track_ids is None:
+        # Not indexed (added by hand, or before the index existed): fall back to one scan of the playlist
+        print(f"  > Album not in library index. Scanning '{playlist_name}'...")
+        with span("tidal.playlist_read", "tidal", playlist=playlist_name) as s:
+            target_tracks = discovery_pl.tracks()
+            s.set(tracks=len(target_tracks))
+        track_ids = [str(t.id) for t in target_tracks if str(t.album.id) == str(album_id)]
+
+    if track_ids:
+        print(f"  > Removing {len(track_ids)} tracks from '{playlist_name}'...")
+        try:
+            with span("tidal.playlist_write", "tidal", playlist=playlist_name, tracks=len(track_ids)):
+                discovery_pl.delete_by_id(track_ids)
+        except Exception as e:
+            # Batch removal failed: fall back to the slower one-by-one removal used by the sweep
+            print(f"    - Batch removal failed ({e}). Removing one by one...")
+            for track_id in track_ids:
+                try:
+                    discovery_pl.remove_by_id(track_id)
+                except Exception as e:
+                    print(f"    - Failed to remove track {track_id}: {e}")
+    else:
+        print(f"  > No tracks from this album found in '{playlist_name}'.")
+    forget_playlist_album(index, playlist_name, album_id)
+
+    update_processed_log(client.history, artist, album, log_status, album_id)
+    record_feedback(client.relevance_model, album_id, log_status, {"artist": artist, "album": album})
+    if write_history:
+        save_history(client.history, profile.processed_log_path)
+    save_library_index(index, profile.library_index_path)
+    save_model(client.relevance_model, profile.model_path)
+    print("CleanupAgent: Direct command complete.")
+
 def process_queue(client, command_pl, target_pl, action):
     """Reads a command playlist, performs actions, clears command playlist."""
-    tracks = command_pl.tracks()
+    with span("tidal.playlist_read", "tidal", playlist=command_pl.name) as s:
+        tracks = command_pl.tracks()
+        s.set(tracks=len(tracks))
     
     if not tracks:
         print(f"  > No commands in '{command_pl.name}'.")
@@ -131,24 +233,32 @@ def process_queue(client, command_pl, target_pl, action):
             # ACTION: PROMOTE (Like the album)
             if action == "PROMOTE":
                 print(f"    - Liking album on Tidal...")
-                client.session.user.favorites.add_album(album_id)
+                with span("tidal.like_album", "tidal", album_id=str(album_id)):
+                    client.session.user.favorites.add_album(album_id)
+                record_favorite(client.library_index, album_id, artist_name, album_title)
                 log_status = "LIKED_VIA_PLAYLIST"
             else:
                 log_status = "EXCLUDED_VIA_PLAYLIST"
 
             # ACTION: Identify tracks to remove from Target (AI Music Discovery)
             # We scan the target playlist for ANY track belonging to this album
-            target_tracks = target_pl.tracks()
+            with span("tidal.playlist_read", "tidal", playlist=target_pl.name) as s:
+                target_tracks = target_pl.tracks()
+                s.set(tracks=len(target_tracks))
             for t in target_tracks:
                 if t.album.id == album_id:
                     items_to_remove_from_target.append(t.id)
             
             # ACTION: Update Log
-            update_processed_log(artist_name, album_title, log_status)
+            update_processed_log(client.history, artist_name, album_title, log_status, album_id)
+            record_feedback(client.relevance_model, album_id, log_status, {"artist": artist_name, "album": album_title})
             
         except Exception as e:
             print(f"    - Error processing item: {e}")
 
+    for album_id in processed_albums:
+        forget_playlist_album(client.library_index, target_pl.name, album_id)
+
     # Batch remove from Target Playlist (FIXED: Loop removal)
     if items_to_remove_from_target:
         print(f"  > Removing {len(items_to_remove_from_target)} tracks from '{target_pl.name}'...")
@@ -158,7 +268,8 @@ def process_queue(client, command_pl, target_pl, action):
         # FIX: Iterate and remove one by one to ensure API acceptance
         for track_id in unique_ids:
             try:
-                target_pl.remove_by_id(track_id)
+                with span("tidal.playlist_write", "tidal", playlist=target_pl.name, tracks=1):
+                    target_pl.remove_by_id(track_id)
             except Exception as e:
                 print(f"    - Failed to remove track {track_id}: {e}")
                 
@@ -171,7 +282,8 @@ def process_queue(client, command_pl, target_pl, action):
         print(f"  > Clearing command playlist '{command_pl.name}'...")
         for track_id in cmd_item_ids:
             try:
-                command_pl.remove_by_id(track_id)
+                with span("tidal.playlist_write", "tidal", playlist=command_pl.name, tracks=1):
+                    command_pl.remove_by_id(track_id)
             except Exception as e:
                 print(f"    - Failed to clear command track {track_id}: {e}")
 
@@ -1,14 +1,31 @@
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from bs4 import BeautifulSoup
 import google.generativeai as genai
 from dotenv import load_dotenv
+from tracing import span
+from llm_usage import RunUsage, estimate_tokens, save_run_usage
+from source_stats import load_source_stats, BREAKER_FAILURE_THRESHOLD
 
 # --- Configuration ---
 PROMPT_FILE_PATH = 'config/discovery_prompt.txt'
 SOURCES_FILE_PATH = 'config/sources.json'
 REPORT_FILE_PATH = 'data/discovery_report.html'
 OUTPUT_DIR = 'data'
+PROBE_WORKERS = 16
+PROBE_TIMEOUT = (5, 10)         # (connect, read) seconds
+SLOW_LATENCY_MS = 2000          # responses slower than this start losing health
+MIN_TEXT_CHARS = 500            # less extractable text than this is not worth an LLM call
+MAX_REDIRECTS_OK = 3
+MIN_HEALTH_SCORE = 0.5          # sources below this never reach sources.json
+MAX_BROKEN_FRACTION = 0.5       # if more existing sources fail than this, suspect our own network
+# A source already in sources.json is only dropped for bad health if a retry fails too AND the harvester
+# has seen it fail repeatedly (BREAKER_FAILURE_THRESHOLD fetches in a row, or an open breaker).
+PROBE_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'}
 
 # --- Load API Key and Configure AI ---
 load_dotenv(dotenv_path='config/.env')
@@ -19,22 +36,123 @@ if not API_KEY:
 else:
     genai.configure(api_key=API_KEY)
 
-def generate_discovery_report(added, removed, current_sources):
+# --- Source Health Probing ---
+def make_probe_session():
+    """One pooled session shared by all probe threads, so repeat hosts reuse their connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=PROBE_WORKERS, pool_maxsize=PROBE_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(PROBE_HEADERS)
+    return session
+
+def _host(url):
+    host = urlparse(url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+def health_score(result):
+    """0.0 (unusable) to 1.0 (fast, direct, plenty of text)."""
+    if result['error'] or not result['status'] or result['status'] >= 400:
+        return 0.0
+    if result['text_chars'] < MIN_TEXT_CHARS:
+        return 0.2
+    score = 1.0
+    if result['latency_ms'] > SLOW_LATENCY_MS:
+        # Linear fall-off to 0.5 at the read timeout
+        slow_span = PROBE_TIMEOUT[1] * 1000 - SLOW_LATENCY_MS
+        score -= 0.5 * min(1.0, (result['latency_ms'] - SLOW_LATENCY_MS) / slow_span)
+    redirects = result['redirects']
+    if len(redirects) > MAX_REDIRECTS_OK:
+        score -= 0.1
+    if redirects and _host(redirects[-1]) != _host(result['url']):
+        score -= 0.1
+    return round(max(score, 0.0), 2)
+
+def probe_url(session, url):
+    result = {"url": url, "status": None, "latency_ms": None, "redirects": [], "text_chars": 0, "error": None}
+    if not url:
+        result['error'] = "No URL"
+        result['health_score'] = 0.0
+        return result
+    with span("discovery.probe", "http", url=url) as s:
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=PROBE_TIMEOUT)
+            result['latency_ms'] = round((time.perf_counter() - start) * 1000)
+            result['status'] = response.status_code
+            result['redirects'] = [r.headers.get('Location', r.url) for r in response.history]
+            if response.ok:
+                result['text_chars'] = len(BeautifulSoup(response.text, 'html.parser').get_text(separator=' ', strip=True))
+            s.set(status=response.status_code, bytes=len(response.content), chars=result['text_chars'])
+        except requests.exceptions.RequestException as e:
+            result['latency_ms'] = round((time.perf_counter() - start) * 1000)
+            result['error'] = str(e)
+    result['health_score'] = health_score(result)
+    return result
+
+def probe_sources(urls):
+    """Probes all URLs concurrently. Returns {url: probe result}."""
+    unique_urls = list(dict.fromkeys(u for u in urls if u))
+    print(f"  > Probing {len(unique_urls)} source URLs ({PROBE_WORKERS} parallel)...")
+    session = make_probe_session()
+    try:
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+            results = list(pool.map(lambda u: probe_url(session, u), unique_urls))
+    finally:
+        session.close()
+    return {r['url']: r for r in results}
+
+def retry_failed(health, urls):
+    """Probes the unhealthy ones among urls a second time and keeps the better result."""
+    failed = [u for u in urls if health[u]['health_score'] < MIN_HEALTH_SCORE]
+    if not failed:
+        return
+    print(f"  > [Health] Retrying {len(failed)} existing sources that failed their first probe...")
+    for url, result in probe_sources(failed).items():
+        if result['health_score'] > health[url]['health_score']:
+            health[url] = result
+
+def repeatedly_failing(stats, source_name):
+    """True if the harvester's own fetch history agrees the source is broken."""
+    entry = stats['sources'].get(source_name)
+    if not entry:
+        return False
+    return entry.get('breaker', 'closed') != 'closed' or entry.get('consecutive_failures', 0) >= BREAKER_FAILURE_THRESHOLD
+
+def describe_health(h):
+    if not h:
+        return "not probed"
+    if h['error']:
+        return f"error: {h['error'][:80]}"
+    parts = [f"HTTP {h['status']}", f"{h['latency_ms']} ms", f"{h['text_chars']:,} chars"]
+    if h['redirects']:
+        parts.append(f"{len(h['redirects'])} redirect(s) → {h['redirects'][-1]}")
+    return ", ".join(parts)
+
+def generate_discovery_report(added, removed, current_sources, rejected=None, health=None, kept=None):
     print(f"  > Generating Discovery HTML report...")
     
+    health = health or {}
+    rejected = rejected or []
+    kept = kept or []
     added_html = "".join([f"<li style='color:green;'><b>+ ADDED:</b> {s['website']} ({s.get('genre_focus', 'N/A')})</li>" for s in added])
     removed_html = "".join([f"<li style='color:red;'><b>- REMOVED:</b> {s['website']}</li>" for s in removed])
+    rejected_html = "".join([f"<li style='color:#b08800;'><b>✗ REJECTED:</b> {s['website']} ({s.get('url')})<br>&nbsp;&nbsp;↳ {reason}</li>" for s, reason in rejected])
+    rejected_html += "".join([f"<li style='color:#586069;'><b>~ KEPT:</b> {s['website']} ({s.get('url')}), not failing repeatedly yet<br>&nbsp;&nbsp;↳ {reason}</li>" for s, reason in kept])
     
     if not added: added_html = "<li>No new sources added.</li>"
     if not removed: removed_html = "<li>No sources removed.</li>"
+    if not rejected and not kept: rejected_html = "<li>No sources failed the health check.</li>"
 
     current_rows = ""
     for s in current_sources:
         name = s.get('website')
         genre = s.get('genre_focus')
         tier = s.get('category', 'N/A')
+        h = health.get(s.get('url'))
+        score = f"{h['health_score']:.2f}" if h else "N/A"
         
-        current_rows += f"<tr><td>{name}</td><td>{genre}</td><td>{tier}</td></tr>"
+        current_rows += f"<tr><td>{name}</td><td>{genre}</td><td>{tier}</td><td>{score}</td><td class='probe'>{describe_health(h)}</td></tr>"
 
     html = f"""
     <!DOCTYPE html>
@@ -51,6 +169,7 @@ def generate_discovery_report(added, removed, current_sources):
             table {{ width: 100%; border-collapse: collapse; margin-top: 20px; background: #fff; }}
             th, td {{ text-align: left; padding: 12px; border-bottom: 1px solid #ddd; }}
             th {{ background-color: #007bff; color: white; }}
+            .probe {{ color: #586069; font-size: 0.85em; }}
             .nav-link {{ display: inline-block; margin-bottom: 20px; padding: 10px 15px; background-color: #e1f5fe; color: #0277bd; text-decoration: none; border-radius: 5px; font-weight: bold; border: 1px solid #b3e5fc; }}
             .nav-link:hover {{ background-color: #b3e5fc; }}
         </style>
@@ -69,9 +188,15 @@ def generate_discovery_report(added, removed, current_sources):
             {removed_html}
         </ul>
 
+        <h2>Failed Health Check ({len(rejected) + len(kept)})</h2>
+        <p>Every proposed and existing URL is probed before it can reach the weekly harvest. New sources scoring below {MIN_HEALTH_SCORE} are dropped; existing ones only after a failed retry and {BREAKER_FAILURE_THRESHOLD}+ failed harvests in a row.</p>
+        <ul>
+            {rejected_html}
+        </ul>
+
         <h2>Current Source List ({len(current_sources)})</h2>
         <table>
-            <tr><th>Source Name</th><th>Focus</th><th>Tier</th></tr>
+            <tr><th>Source Name</th><th>Focus</th><th>Tier</th><th>Health</th><th>Probe</th></tr>
             {current_rows}
         </table>
     </body>
@@ -110,12 +235,16 @@ def run_discovery():
 
     # 3. Call AI
     print("  > [AI] Calling Gemini to audit and curate sources...")
+    run_usage = RunUsage("discovery")
     try:
         model = genai.GenerativeModel(
             'gemini-2.5-flash',
             system_instruction=system_prompt
         )
-        response = model.generate_content(user_content)
+        with span("llm.generate_content", "llm", source="discovery", chars=len(user_content)) as s:
+            response = model.generate_content(user_content)
+            input_tokens, output_tokens = run_usage.record("discovery", response, estimate_tokens(system_prompt, user_content))
+            s.set(output_chars=len(response.text), input_tokens=input_tokens, output_tokens=output_tokens)
         
         json_text = response.text.strip().replace("```json", "").replace("```", "")
         new_sources_list = json.loads(json_text)
@@ -124,6 +253,9 @@ def run_discovery():
     except Exception as e:
         print(f"  > [AI Error] An error occurred: {e}")
         return
+    finally:
+        if run_usage.requests:
+            save_run_usage(run_usage)
 
     # 4. Diff & Update Logic
     old_names = {s['website'] for s in current_sources_list}
@@ -141,6 +273,34 @@ def run_discovery():
             "url": s.get('URL')
         })
 
+    # 5. Health Check: probe every proposed and existing URL before anything reaches sources.json
+    health = probe_sources([s['url'] for s in final_config_list] + [s.get('url') for s in current_sources_list])
+    existing_urls = [s.get('url') for s in current_sources_list if s.get('url')]
+    retry_failed(health, list(dict.fromkeys(existing_urls)))
+    broken_existing = [u for u in existing_urls if health[u]['health_score'] < MIN_HEALTH_SCORE]
+    if existing_urls and len(broken_existing) > len(existing_urls) * MAX_BROKEN_FRACTION:
+        print(f"  > [Health] {len(broken_existing)}/{len(existing_urls)} existing sources failed. Assuming a network problem; keeping {SOURCES_FILE_PATH} unchanged.")
+        return
+
+    # Probe results stay in the report; sources.json only holds curated fields
+    source_stats = load_source_stats()
+    healthy_list = []
+    rejected_sources = []
+    kept_sources = []
+    for s in final_config_list:
+        h = health.get(s['url'])
+        if not h or h['health_score'] < MIN_HEALTH_SCORE:
+            existing = s['website'] in old_names or s['url'] in existing_urls
+            if existing and not repeatedly_failing(source_stats, s['website']):
+                kept_sources.append((s, describe_health(h)))
+                healthy_list.append(s)
+            else:
+                rejected_sources.append((s, describe_health(h)))
+            continue
+        healthy_list.append(s)
+    final_config_list = healthy_list
+    print(f"  > [Health] {len(final_config_list)} sources kept ({len(kept_sources)} despite a failed probe), {len(rejected_sources)} rejected.")
+
     new_names = {s['website'] for s in final_config_list}
     
     added_sources = [s for s in final_config_list if s['website'] not in old_names]
@@ -156,7 +316,7 @@ def run_discovery():
     print(f"  > Overwrote {SOURCES_FILE_PATH} with new source list.")
 
     # 7. Generate Report
-    generate_discovery_report(added_sources, removed_sources, final_config_list)
+    generate_discovery_report(added_sources, removed_sources, final_config_list, rejected_sources, health, kept_sources)
     
     print("\nSourceDiscoveryAgent: Run complete.")
 
@@ -2,15 +2,21 @@ import requests
 from bs4 import BeautifulSoup
 import json
 import os
+import time
+from tracing import span
+from source_stats import (load_source_stats, save_source_stats, schedule_sources, record_fetch,
+                          source_entry, fetch_timeout)
+from snapshot_store import put_text, record_run
 
 # --- Configuration ---
 SOURCES_FILE_PATH = 'config/sources.json'
 OUTPUT_PAGES_FILE = 'data/raw_album_list.json'
 OUTPUT_LOG_FILE = 'data/harvester_log.json' # <-- NEW LOG FILE
 OUTPUT_DIR = 'data'
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'}
 
 # --- Main Function ---
-def harvest_new_albums():
+def harvest_new_albums(http=None):
     print("HarvesterAgent: Starting run (AI-Parser Mode)...")
     
     try:
@@ -23,36 +29,64 @@ def harvest_new_albums():
     pages_to_analyze = []
     harvester_log = [] # <-- NEW: We'll log our actions
     
-    for source in sources_config['sources']:
+    # Fetch the highest expected-yield sources first and skip the ones the budget can't cover
+    source_stats = load_source_stats()
+    scheduled_sources, skipped_sources = schedule_sources(sources_config['sources'], source_stats)
+    print(f"Scheduler: {len(scheduled_sources)} sources scheduled, {len(skipped_sources)} skipped.")
+    for source, reason in skipped_sources:
+        harvester_log.append({"status": "skipped", "source": source['website'], "message": reason})
+
+    if http is None:
+        http = requests.Session()
+    http.headers.update(HEADERS)
+    
+    for source in scheduled_sources:
         source_name = source['website'] 
         source_url = source['url']
+        entry = source_entry(source_stats, source_name)
+        timeout = fetch_timeout(entry)
+        probe = " [half-open probe]" if entry['breaker'] == "half_open" else ""
         
-        print(f"\nFetching text from: {source_name} ({source_url})")
+        print(f"\nFetching text from: {source_name} ({source_url}), timeout {timeout[1]}s{probe}")
         
+        started = time.perf_counter()
         try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'}
-            response = requests.get(source_url, headers=headers, timeout=15)
-            response.raise_for_status() 
+            with span("harvest.fetch", "http", source=source_name, timeout_s=timeout[1]) as s:
+                response = http.get(source_url, timeout=timeout)
+                s.set(status=response.status_code, bytes=len(response.content))
+                response.raise_for_status() 
+            latency_ms = (time.perf_counter() - started) * 1000
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            page_text = soup.get_text(separator=' ', strip=True)
+            with span("harvest.parse", "parse", source=source_name) as s:
+                soup = BeautifulSoup(response.text, 'html.parser')
+                page_text = soup.get_text(separator=' ', strip=True)
+                s.set(chars=len(page_text))
             
             if page_text:
+                # Page text goes to the snapshot store; an unchanged page reuses its existing blob
                 pages_to_analyze.append({
                     "source_name": source_name,
                     "source_url": source_url,
-                    "page_text": page_text
+                    "page_ref": put_text(page_text),
+                    "chars": len(page_text)
                 })
-                log_entry = {"status": "success", "source": source_name, "message": f"Fetched {len(page_text)} chars"}
+                log_entry = {"status": "success", "source": source_name, "message": f"Fetched {len(page_text)} chars in {latency_ms:.0f} ms{probe}"}
                 harvester_log.append(log_entry)
                 print(f"  > {log_entry['message']}")
             else:
                 log_entry = {"status": "error", "source": source_name, "message": "Found no text on page."}
                 harvester_log.append(log_entry)
                 print(f"  > {log_entry['message']}")
+            record_fetch(source_stats, source_name, ok=bool(page_text), latency_ms=latency_ms)
 
         except requests.exceptions.RequestException as e:
-            error_msg = str(e)
+            # A timeout counts as a sample at the timeout, so a slow-but-alive source earns a longer one
+            timed_out = isinstance(e, requests.exceptions.Timeout)
+            record_fetch(source_stats, source_name, ok=False, latency_ms=timeout[1] * 1000 if timed_out else None)
+            error_msg = str(e) + probe
+            if entry['breaker'] == "open":
+                error_msg += " Circuit breaker is now open."
+
             log_entry = {"status": "error", "source": source_name, "message": error_msg}
             harvester_log.append(log_entry)
             print(f"  > Error fetching {source_url}: {error_msg}")
@@ -60,12 +94,15 @@ def harvest_new_albums():
     # Save the results
     os.makedirs(OUTPUT_DIR, exist_ok=True) 
     
-    with open(OUTPUT_PAGES_FILE, 'w') as f:
-        json.dump(pages_to_analyze, f, indent=2)
+    with span("harvest.save", "io", pages=len(pages_to_analyze)):
+        with open(OUTPUT_PAGES_FILE, 'w') as f:
+            json.dump(pages_to_analyze, f, indent=2)
+    record_run("harvest", {p['source_name']: p['page_ref'] for p in pages_to_analyze})
         
     # --- NEW: Save the harvester log ---
     with open(OUTPUT_LOG_FILE, 'w') as f:
         json.dump(harvester_log, f, indent=2)
+    save_source_stats(source_stats)
         
     print(f"\nHarvesterAgent: Run complete. Found {len(pages_to_analyze)} pages to analyze.")
     print(f"Results saved to {OUTPUT_PAGES_FILE} and {OUTPUT_LOG_FILE}")
@@ -0,0 +1,204 @@
+import json
+import os
+import time
+from tidalapi.types import AlbumOrder, ItemOrder, OrderDirection
+
+# --- Configuration ---
+INDEX_FILE_PATH = 'data/library_index.json'  # the default profile's; see Profile.library_index_path
+SNAPSHOT_PAGE_SIZE = 100
+FULL_REFRESH_SECONDS = 7 * 24 * 3600  # incremental syncs can't see removals, so rebuild weekly
+
+# --- Local index of our Tidal state ---
+# {
+#   "playlists": {playlist name: playlist id},
+#   "playlist_albums": {playlist name: {album id: [track ids]}},
+#   "playlist_sync": {playlist name: {"synced": ts, "full_sync": ts, "last_updated": ts, "num_tracks": n}},
+#   "favorites": {album id: added ts},
+#   "favorites_sync": {"synced": ts, "full_sync": ts},
+#   "album_keys": {album id: "artist::album" (lowercased)},
+#   "album_names": {album id: [artist, album]} (as Tidal spells them),
+#   "updated": unix timestamp
+# }
+# Lets a single-album command go straight to the tracks it needs to remove, and lets
+# the Tidal stage skip albums already liked or already in the playlist before searching.
+
+def load_library_index(path=INDEX_FILE_PATH):
+    try:
+        with open(path, 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        index = {}
+    index.setdefault("playlists", {})
+    index.setdefault("playlist_albums", {})
+    index.setdefault("playlist_sync", {})
+    index.setdefault("favorites", {})
+    index.setdefault("favorites_sync", {"synced": 0, "full_sync": 0})
+    index.setdefault("album_keys", {})
+    index.setdefault("album_names", {})
+    index.setdefault("updated", 0)
+    return index
+
+def save_library_index(index, path=INDEX_FILE_PATH):
+    index['updated'] = time.time()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(index, f)
+
+def album_key(artist, album):
+    return f"{(artist or '').strip().lower()}::{(album or '').strip().lower()}"
+
+def _timestamp(dt):
+    return dt.timestamp() if dt else 0.0
+
+def _remember_names(index, album_id, artist, album):
+    index['album_keys'][str(album_id)] = album_key(artist, album)
+    index['album_names'][str(album_id)] = [artist, album]
+
+def _remember_album(index, album):
+    artist = album.artist.name if getattr(album, 'artist', None) else ''
+    _remember_names(index, album.id, artist, album.name)
+
+def album_names(index, album_id):
+    """(artist, album) with their original casing, or None if the album was indexed before names were kept."""
+    names = index['album_names'].get(str(album_id))
+    return tuple(names) if names else None
+
+def remember_playlist(index, name, playlist_id):
+    index['playlists'][name] = str(playlist_id)
+
+def record_playlist_album(index, playlist_name, album_id, track_ids, artist=None, album=None):
+    albums = index['playlist_albums'].setdefault(playlist_name, {})
+    albums[str(album_id)] = [str(t) for t in track_ids]
+    if artist and album:
+        _remember_names(index, album_id, artist, album)
+
+def record_favorite(index, album_id, artist=None, album=None):
+    index['favorites'][str(album_id)] = time.time()
+    if artist and album:
+        _remember_names(index, album_id, artist, album)
+
+def playlist_album_tracks(index, playlist_name, album_id):
+    """Track ids we added to the playlist for this album, or None if the album isn't indexed."""
+    return index['playlist_albums'].get(playlist_name, {}).get(str(album_id))
+
+def forget_playlist_album(index, playlist_name, album_id):
+    index['playlist_albums'].get(playlist_name, {}).pop(str(album_id), None)
+
+def is_favorite(index, album_id):
+    return str(album_id) in index['favorites']
+
+def in_playlist(index, playlist_name, album_id):
+    return str(album_id) in index['playlist_albums'].get(playlist_name, {})
+
+def library_album_keys(index, playlist_name):
+    """Returns (favorite keys, playlist keys) as sets of "artist::album" for pre-search checks."""
+    keys = index['album_keys']
+    favorites = {keys[a] for a in index['favorites'] if a in keys}
+    playlist = {keys[a] for a in index['playlist_albums'].get(playlist_name, {}) if a in keys}
+    return favorites, playlist
+
+def cached_playlist(session, index, name):
+    """Fetches a playlist by its cached id (one API call). Returns None if unknown or stale."""
+    playlist_id = index['playlists'].get(name)
+    if not playlist_id:
+        return None
+    try:
+        playlist = session.playlist(playlist_id)
+    except Exception:
+        return None
+    if playlist is None or playlist.name != name:
+        return None
+    return playlist
+
+# --- Snapshot Refresh (paged bulk fetches) ---
+def _pages(fetch):
+    """Yields pages from fetch(limit, offset) until a short page."""
+    offset = 0
+    while True:
+        page = fetch(SNAPSHOT_PAGE_SIZE, offset)
+        yield page
+        if len(page) < SNAPSHOT_PAGE_SIZE:
+            return
+        offset += SNAPSHOT_PAGE_SIZE
+
+def refresh_favorites(session, index, force_full=False):
+    """
+    Syncs favorite albums newest-first. Incremental runs stop at the first album
+    older than the last sync; a full rebuild runs weekly (or when forced) to pick up removals.
+    Returns the number of API pages fetched.
+    """
+    sync = index['favorites_sync']
+    now = time.time()
+    full = force_full or not sync['full_sync'] or now - sync['full_sync'] > FULL_REFRESH_SECONDS
+    since = 0 if full else sync['synced']
+    fetched = {}
+    pages = 0
+    for page in _pages(lambda limit, offset: session.user.favorites.albums(
+            limit=limit, offset=offset, order=AlbumOrder.DateAdded, order_direction=OrderDirection.Descending)):
+        pages += 1
+        reached_known = False
+        for album in page:
+            added = _timestamp(getattr(album, 'user_date_added', None))
+            if not full and added and added <= since:
+                reached_known = True
+                break
+            fetched[str(album.id)] = added or now
+            _remember_album(index, album)
+        if reached_known:
+            break
+    if full:
+        index['favorites'] = fetched
+        sync['full_sync'] = now
+    else:
+        index['favorites'].update(fetched)
+    sync['synced'] = now
+    return pages
+
+def refresh_playlist(index, playlist, force_full=False):
+    """
+    Syncs one playlist's album -> tracks map. Unchanged playlists cost nothing; additions
+    are fetched newest-first; anything that doesn't add up (or force_full) triggers a full paged rebuild.
+    Returns the number of API pages fetched.
+    """
+    name = playlist.name
+    sync = index['playlist_sync'].get(name)
+    now = time.time()
+    last_updated = _timestamp(getattr(playlist, 'last_updated', None))
+    albums = index['playlist_albums'].setdefault(name, {})
+    known_tracks = sum(len(t) for t in albums.values())
+
+    if sync and not force_full and now - sync['full_sync'] <= FULL_REFRESH_SECONDS:
+        if last_updated and sync['last_updated'] == last_updated and playlist.num_tracks == known_tracks:
+            return 0
+        new_tracks, pages = [], 0
+        for page in _pages(lambda limit, offset: playlist.tracks(
+                limit=limit, offset=offset, order=ItemOrder.Date, order_direction=OrderDirection.Descending)):
+            pages += 1
+            fresh = [t for t in page if _timestamp(getattr(t, 'user_date_added', None)) > sync['synced']]
+            new_tracks.extend(fresh)
+            if len(fresh) < len(page):
+                break
+        known_ids = {t for tracks in albums.values() for t in tracks}
+        new_tracks = [t for t in new_tracks if str(t.id) not in known_ids]
+        if known_tracks + len(new_tracks) == playlist.num_tracks:
+            _add_tracks(index, albums, new_tracks)
+            sync.update(synced=now, last_updated=last_updated, num_tracks=playlist.num_tracks)
+            return pages
+    else:
+        pages = 0
+
+    # Full rebuild
+    albums.clear()
+    for page in _pages(lambda limit, offset: playlist.tracks(limit=limit, offset=offset)):
+        pages += 1
+        _add_tracks(index, albums, page)
+    index['playlist_sync'][name] = {"synced": now, "full_sync": now, "last_updated": last_updated, "num_tracks": playlist.num_tracks}
+    return pages
+
+def _add_tracks(index, albums, tracks):
+    for track in tracks:
+        album = getattr(track, 'album', None)
+        if album is None:
+            continue
+        albums.setdefault(str(album.id), []).append(str(track.id))
+        _remember_album(index, album)
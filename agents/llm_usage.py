@@ -0,0 +1,135 @@
+import json
+import os
+import time
+
+# --- Configuration ---
+USAGE_FILE_PATH = 'data/llm_usage.json'  # the default profile's (and the harvest scheduler's); see Profile.usage_path
+MAX_RUNS_KEPT = 50
+# Per-run Gemini budget (0 = unlimited). Pages are analyzed in source priority order until it runs out.
+MAX_TOKENS_PER_RUN = int(os.getenv("LLM_MAX_TOKENS_PER_RUN", "500000"))
+MAX_REQUESTS_PER_RUN = int(os.getenv("LLM_MAX_REQUESTS_PER_RUN", "40"))
+# Rough list prices (USD per million tokens) used only for the report's cost estimate
+INPUT_COST_PER_MTOK = 0.30
+OUTPUT_COST_PER_MTOK = 2.50
+CHARS_PER_TOKEN = 4
+DEFAULT_OUTPUT_TOKENS = 2000  # output reserved per call before the run has an average of its own
+
+def estimate_tokens(*texts):
+    """Cheap pre-call estimate, used to decide whether a call still fits the budget."""
+    return sum(len(t) for t in texts) // CHARS_PER_TOKEN
+
+def estimate_cost(input_tokens, output_tokens):
+    return (input_tokens * INPUT_COST_PER_MTOK + output_tokens * OUTPUT_COST_PER_MTOK) / 1_000_000
+
+class RunUsage:
+    """Token/request accounting for one agent run, with an optional budget."""
+    def __init__(self, agent, max_tokens=0, max_requests=0):
+        self.agent = agent
+        self.max_tokens = max_tokens      # 0 = unlimited
+        self.max_requests = max_requests  # 0 = unlimited
+        self.started = time.time()
+        self.sources = {}
+        self.deferred = []
+
+    def _source(self, source_name):
+        return self.sources.setdefault(source_name, {"requests": 0, "failed": 0, "input_tokens": 0, "output_tokens": 0, "albums": 0})
+
+    @property
+    def requests(self):
+        return sum(s['requests'] for s in self.sources.values())
+
+    @property
+    def failed(self):
+        return sum(s.get('failed', 0) for s in self.sources.values())
+
+    @property
+    def input_tokens(self):
+        return sum(s['input_tokens'] for s in self.sources.values())
+
+    @property
+    def output_tokens(self):
+        return sum(s['output_tokens'] for s in self.sources.values())
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    def expected_output_tokens(self):
+        """Average output per call so far this run; the answer has to fit the budget too."""
+        return self.output_tokens // self.requests if self.requests else DEFAULT_OUTPUT_TOKENS
+
+    def can_afford(self, estimated_tokens):
+        """estimated_tokens is the call's input; an average answer's worth of output is reserved on top."""
+        if self.max_requests and self.requests + 1 > self.max_requests:
+            return False
+        if self.max_tokens and self.total_tokens + estimated_tokens + self.expected_output_tokens() > self.max_tokens:
+            return False
+        return True
+
+    def record(self, source_name, response, estimated_tokens=0):
+        """Adds one call's usage_metadata. Falls back to the estimate if the SDK returned none."""
+        usage = getattr(response, 'usage_metadata', None)
+        input_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+        if not usage:
+            input_tokens = estimated_tokens
+        entry = self._source(source_name)
+        entry['requests'] += 1
+        entry['input_tokens'] += input_tokens
+        entry['output_tokens'] += output_tokens
+        return input_tokens, output_tokens
+
+    def record_failure(self, source_name):
+        """A call that failed before Gemini returned anything: counted apart, with no tokens."""
+        self._source(source_name)['failed'] += 1
+
+    def record_albums(self, source_name, count):
+        self._source(source_name)['albums'] += count
+
+    def defer(self, source_name, reason):
+        self.deferred.append({"source": source_name, "reason": reason})
+
+    def to_dict(self):
+        return {
+            "agent": self.agent,
+            "timestamp": self.started,
+            "budget": {"max_tokens": self.max_tokens, "max_requests": self.max_requests},
+            "requests": self.requests,
+            "failed_requests": self.failed,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "estimated_cost_usd": round(estimate_cost(self.input_tokens, self.output_tokens), 4),
+            "sources": self.sources,
+            "deferred": self.deferred,
+        }
+
+# --- Persistence ---
+def load_usage_history(path=USAGE_FILE_PATH):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"runs": [], "sources": {}}
+
+def save_run_usage(run_usage, path=USAGE_FILE_PATH):
+    """Appends the run to data/llm_usage.json (or path) and folds it into the all-time per-source totals."""
+    history = load_usage_history(path)
+    run = run_usage.to_dict()
+    history['runs'].append(run)
+    history['runs'] = history['runs'][-MAX_RUNS_KEPT:]
+    for name, s in run['sources'].items():
+        total = history['sources'].setdefault(name, {})
+        for key, value in s.items():
+            total[key] = total.get(key, 0) + value
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
+    print(f"  > LLM usage: {run['requests']} requests ({run['failed_requests']} failed), {run['input_tokens']} in / {run['output_tokens']} out tokens "
+          f"(~${run['estimated_cost_usd']}). Saved to {path}")
+    return run
+
+def latest_run(agent, path=USAGE_FILE_PATH):
+    for run in reversed(load_usage_history(path)['runs']):
+        if run['agent'] == agent:
+            return run
+    return None
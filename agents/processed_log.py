@@ -0,0 +1,24 @@
+import json
+import os
+from tracing import span
+
+# --- Configuration ---
+PROCESSED_LOG_PATH = 'data/processed_albums.json'  # the default profile's; see Profile.processed_log_path
+
+# --- History of every album the agents acted on ---
+# [{"key": "artist::album", "artist", "album", "timestamp", "action", "album_id", "source_name"}]
+# Loaded once per Tidal client (the daemon shares one list between its clients) and
+# changed in memory; whoever changes it decides when to write it back.
+
+def load_history(path=PROCESSED_LOG_PATH):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+def save_history(history, path=PROCESSED_LOG_PATH):
+    with span("history.save", "io", entries=len(history)):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(history, f, indent=2)
@@ -0,0 +1,165 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import analysis_agent
+import cleanup_agent
+import source_stats
+import tidal_agent
+import tracing
+from tracing import span
+from harvester_agent import harvest_new_albums
+from agent_profile import Profile, DEFAULT_DATA_DIR, DEFAULT_CACHE_DIR
+
+# --- Configuration ---
+PROFILES_FILE_PATH = 'config/profiles.json'
+PROFILES_DATA_DIR = 'data/profiles'     # a profile without "data_dir" keeps its state in data/profiles/<name>
+PROFILES_CACHE_DIR = '.cache/profiles'  # ...and its uncommitted scratch state (relevance replay) in .cache/profiles/<name>
+PROFILE_STATS_FILE = 'profile_source_stats.json'  # private copy of source stats during a profile run
+MAX_PARALLEL_PROFILES = 4
+
+# --- Profile format (config/profiles.json) ---
+# {"profiles": [{"name": "alex",                      required, unique
+#                "enabled": true,
+#                "data_dir": "data/profiles/alex",     "data" for the original single-profile files
+#                "prompt": "config/profiles/alex.txt",
+#                "tidal_env_prefix": "TIDAL_ALEX_",     reads TIDAL_ALEX_ACCESS_TOKEN etc. instead of TIDAL_ACCESS_TOKEN
+#                "playlist_name": "AI Music Discovery",
+#                "max_liked_albums_per_run": 5, "fuzzy_match_threshold": 85,
+#                "min_relevance_score": 0, "gate_skip_below": 0.15}]}
+# Omitted settings keep the agent_profile defaults. Harvest output, snapshots, source stats and
+# config/sources.json are shared; everything a profile learns or decides lives in its data_dir.
+PROFILE_SETTINGS = ("data_dir", "prompt", "tidal_env_prefix", "playlist_name", "max_liked_albums_per_run",
+                    "fuzzy_match_threshold", "min_relevance_score", "gate_skip_below")
+
+_llm_lock = None  # set in each worker process; one profile talks to Gemini at a time (shared free-tier limit)
+
+# --- Loading ---
+def load_profiles(path=PROFILES_FILE_PATH):
+    """Enabled profiles as Profile objects. Raises ValueError on a malformed file."""
+    with open(path, 'r') as f:
+        config = json.load(f)
+    profiles, seen = [], set()
+    for raw in config.get('profiles', []):
+        name = str(raw.get('name') or '').strip()
+        if not name or name in seen:
+            raise ValueError(f"Profile names must be present and unique (got '{name}').")
+        seen.add(name)
+        unknown = set(raw) - set(PROFILE_SETTINGS) - {"name", "enabled"}
+        if unknown:
+            raise ValueError(f"Profile '{name}': unknown settings {', '.join(sorted(unknown))}.")
+        if not raw.get('enabled', True):
+            continue
+        settings = {key: raw[key] for key in PROFILE_SETTINGS if key in raw}
+        data_dir = settings.setdefault('data_dir', os.path.join(PROFILES_DATA_DIR, name))
+        # A profile living in data/ is the single-profile setup and keeps its replay in .cache/ too
+        settings['cache_dir'] = DEFAULT_CACHE_DIR if data_dir == DEFAULT_DATA_DIR else os.path.join(PROFILES_CACHE_DIR, name)
+        settings['stats_path'] = os.path.join(data_dir, PROFILE_STATS_FILE)
+        profiles.append(Profile(name, **settings))
+    return profiles
+
+# --- Per-profile Run ---
+def run_profile(profile, llm_lock=None):
+    """Stages 2-4 for one profile. Returns {"name", "ok", "elapsed_s", "yields"}; never raises."""
+    name = profile.name
+    started = time.time()
+    result = {"name": name, "ok": False, "elapsed_s": 0, "yields": {}}
+    try:
+        os.makedirs(profile.data_dir, exist_ok=True)
+        # The stages record yields into a private copy of the shared stats; the batch merges what each run added
+        stats_before = source_stats.load_source_stats()
+        source_stats.save_source_stats(stats_before, profile.stats_path)
+        tidal_client = None
+        try:
+            tidal_client = tidal_agent.RealTidalClient(profile=profile)
+        except Exception as e:
+            print(f"[{name}] Tidal unavailable, no lookups during analysis: {e}")
+        with llm_lock or contextlib.nullcontext():
+            print(f"\n--- [{name}] STAGE 2: ANALYSIS AGENT ---")
+            # Playlist candidates are searched on Tidal as Gemini streams them, as in main_workflow.py
+            prefetcher = tidal_agent.AlbumPrefetcher(tidal_client) if tidal_client else None
+            try:
+                with span("stage.analysis", "stage", profile=name):
+                    analysis_agent.analyze_albums(on_album=prefetcher.submit if prefetcher else None, profile=profile)
+            finally:
+                if prefetcher:
+                    prefetcher.close()
+        print(f"\n--- [{name}] STAGE 3: TIDAL ACTION AGENT ---")
+        with span("stage.tidal", "stage", profile=name):
+            tidal_agent.take_tidal_actions(tidal_client, profile)
+        print(f"\n--- [{name}] STAGE 4: CLEANUP & COMMAND AGENT ---")
+        with span("stage.cleanup", "stage", profile=name):
+            cleanup_agent.process_commands(profile=profile)
+        tidal_agent.add_trace_summary(profile)
+        result['yields'] = source_stats.yield_delta(stats_before, source_stats.load_source_stats(profile.stats_path))
+        os.remove(profile.stats_path)
+        result['ok'] = True
+    except Exception as e:
+        print(f"ProfileRunner: Profile '{name}' failed: {e}")
+    result['elapsed_s'] = round(time.time() - started, 1)
+    return result
+
+def _init_worker(llm_lock):
+    global _llm_lock
+    _llm_lock = llm_lock
+
+def _run_profile_worker(profile):
+    tracing.reset()  # a forked worker starts with the parent's harvest spans
+    result = run_profile(profile, _llm_lock)
+    result['trace'] = tracing.events()
+    return result
+
+def run_profiles(profiles, workers=MAX_PARALLEL_PROFILES):
+    """
+    Runs every profile against the current harvest. With workers > 1 each profile gets its own
+    process; analysis is still serialized across them, while the Tidal and cleanup stages
+    overlap. workers=1 runs them in this process.
+    """
+    workers = max(1, min(workers, len(profiles)))
+    if workers == 1:
+        return [run_profile(profile) for profile in profiles]
+    llm_lock = multiprocessing.Lock()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(llm_lock,)) as pool:
+        results = list(pool.map(_run_profile_worker, profiles))
+    for result in results:
+        tracing.merge(result.pop('trace', []))
+    return results
+
+# --- Main Function ---
+def run_batch(workers=MAX_PARALLEL_PROFILES, http=None):
+    """One harvest, then analysis, Tidal and cleanup for every enabled profile."""
+    print("ProfileRunner: Starting batch run...")
+    try:
+        profiles = load_profiles()
+    except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
+        print(f"Error: Could not load profiles from {PROFILES_FILE_PATH}: {e}")
+        return []
+    if not profiles:
+        print("No enabled profiles. Exiting.")
+        return []
+    print(f"  > {len(profiles)} profiles: {', '.join(p.name for p in profiles)}.")
+
+    print("\n--- STAGE 1: HARVESTER AGENT (shared) ---")
+    with span("stage.harvest", "stage"):
+        harvest_new_albums(http)
+
+    results = run_profiles(profiles, workers)
+
+    # Yields from every profile feed the shared harvest scheduler
+    stats = source_stats.load_source_stats()
+    for result in results:
+        source_stats.merge_yields(stats, result['yields'])
+    source_stats.save_source_stats(stats)
+
+    print("\nProfileRunner: Batch complete.")
+    for result in results:
+        print(f"  - {result['name']}: {'ok' if result['ok'] else 'FAILED'} in {result['elapsed_s']}s")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the workflow for every profile in config/profiles.json, harvesting once.")
+    parser.add_argument("--workers", type=int, default=MAX_PARALLEL_PROFILES, help="Profiles run in parallel (1 = in this process).")
+    run_batch(workers=parser.parse_args().workers)
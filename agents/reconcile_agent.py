@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import time
+from cleanup_agent import RealTidalClient, REMOVE_CMD_PLAYLIST, PROMOTE_CMD_PLAYLIST
+from library_index import (save_library_index, remember_playlist, cached_playlist,
+                           refresh_favorites, refresh_playlist, forget_playlist_album, album_key, album_names)
+from relevance_model import load_model, record_feedback, save_model
+from tracing import span
+from processed_log import save_history
+
+# --- Configuration ---
+# History, report and discovery playlist come from the Profile
+REPORT_SAMPLE_SIZE = 50  # albums listed per drift category in the report
+
+LIKED_ACTIONS = {"LIKE_IMMEDIATELY", "LIKED_VIA_PLAYLIST", "LIKED_IN_APP"}
+PLAYLIST_ACTIONS = {"ADD_TO_PLAYLIST", "ADDED_IN_APP"}
+EXCLUDED_ACTIONS = {"EXCLUDED_VIA_PLAYLIST"}
+
+# --- Drift categories ---
+# unliked_in_app        history says liked, album no longer in favorites        -> action UNLIKED_IN_APP
+# liked_in_app          history says playlist, album now in favorites instead   -> action LIKED_IN_APP
+# removed_in_app        history says playlist, album gone from playlist         -> action REMOVED_IN_APP
+# untracked_favorites   favorite album with no history entry                    -> new LIKED_IN_APP entry
+# untracked_playlist    discovery playlist album with no history entry          -> new ADDED_IN_APP entry
+# stale_in_playlist     excluded/promoted album still in the discovery playlist -> tracks removed (one batch)
+# backfilled_ids        entry without album_id matched by name                  -> album_id stored
+# pending_commands      albums waiting in the command playlists (reported only, the cleanup agent owns them)
+# unverifiable          entry with no album_id and no name match (reported only, likely a fuzzy match)
+
+def find_playlists(client, names):
+    """Looks playlists up by cached id, with at most one playlist listing for the rest. Never creates."""
+    found = {}
+    for name in names:
+        playlist = cached_playlist(client.session, client.library_index, name)
+        if playlist is not None:
+            found[name] = playlist
+    missing = [n for n in names if n not in found]
+    if missing:
+        with span("tidal.list_playlists", "tidal"):
+            for pl in client.session.user.playlists():
+                if pl.name in missing and pl.name not in found:
+                    found[pl.name] = pl
+                    remember_playlist(client.library_index, pl.name, pl.id)
+    return found
+
+def pull_live_state(client, playlists):
+    """Full paged refresh of favorites and every playlist in `playlists` into the library index."""
+    index = client.library_index
+    with span("tidal.snapshot_refresh", "tidal", target="favorites") as s:
+        s.set(pages=refresh_favorites(client.session, index, force_full=True))
+    for name, playlist in playlists.items():
+        with span("tidal.snapshot_refresh", "tidal", target=name) as s:
+            s.set(pages=refresh_playlist(index, playlist, force_full=True))
+    return index
+
+def compute_drift(history, index, discovery_playlist):
+    """
+    Compares history against the live snapshot, all in memory.
+    Returns (drift, updates, new_entries, stale_album_ids) where updates maps
+    history position -> fields to change.
+    """
+    favorites = set(index['favorites'])
+    discovery = set(index['playlist_albums'].get(discovery_playlist, {}))
+    pending = set(index['playlist_albums'].get(REMOVE_CMD_PLAYLIST, {})) | set(index['playlist_albums'].get(PROMOTE_CMD_PLAYLIST, {}))
+    by_name = {}
+    for album_id, key in index['album_keys'].items():
+        by_name.setdefault(key, album_id)
+
+    drift = {k: [] for k in ("unliked_in_app", "liked_in_app", "removed_in_app", "untracked_favorites", "untracked_playlist",
+                             "stale_in_playlist", "backfilled_ids", "pending_commands", "unverifiable")}
+    updates, tracked_ids, stale = {}, set(), set()
+
+    for pos, entry in enumerate(history):
+        action = entry.get('action')
+        album_id = entry.get('album_id')
+        label = entry.get('key')
+        if not album_id:
+            album_id = by_name.get(album_key(entry.get('artist'), entry.get('album')))
+            if album_id:
+                updates.setdefault(pos, {})['album_id'] = album_id
+                drift['backfilled_ids'].append(label)
+        if not album_id:
+            if action in LIKED_ACTIONS | PLAYLIST_ACTIONS | EXCLUDED_ACTIONS:
+                drift['unverifiable'].append(label)
+            continue
+        album_id = str(album_id)
+        tracked_ids.add(album_id)
+        if album_id in pending:
+            continue
+
+        if action in LIKED_ACTIONS:
+            if album_id not in favorites:
+                updates.setdefault(pos, {})['action'] = "UNLIKED_IN_APP"
+                drift['unliked_in_app'].append(label)
+            elif action == "LIKED_VIA_PLAYLIST" and album_id in discovery:
+                stale.add(album_id)
+                drift['stale_in_playlist'].append(label)
+        elif action in PLAYLIST_ACTIONS and album_id not in discovery:
+            new_action = "LIKED_IN_APP" if album_id in favorites else "REMOVED_IN_APP"
+            updates.setdefault(pos, {})['action'] = new_action
+            drift['liked_in_app' if new_action == "LIKED_IN_APP" else 'removed_in_app'].append(label)
+        elif action in EXCLUDED_ACTIONS and album_id in discovery:
+            stale.add(album_id)
+            drift['stale_in_playlist'].append(label)
+
+    new_entries = []
+    for album_ids, action, category in ((favorites, "LIKED_IN_APP", 'untracked_favorites'),
+                                        (discovery - favorites, "ADDED_IN_APP", 'untracked_playlist')):
+        for album_id in sorted(album_ids - tracked_ids - pending):
+            # Entries use the same case-sensitive "artist::album" key as the other agents;
+            # the lowercased album_keys are only for matching
+            names = album_names(index, album_id)
+            if not names:
+                continue
+            artist, album = names
+            key = f"{artist}::{album}"
+            new_entries.append({"key": key, "artist": artist, "album": album, "timestamp": time.time(),
+                                "action": action, "album_id": album_id})
+            tracked_ids.add(album_id)
+            drift[category].append(key)
+
+    for album_id in sorted(pending):
+        drift['pending_commands'].append(index['album_keys'].get(album_id, album_id))
+    return drift, updates, new_entries, stale
+
+def apply_corrections(client, history, updates, new_entries, stale, discovery_pl):
+    """One history write and at most one batch removal from the discovery playlist."""
+    now = time.time()
+    for pos, fields in updates.items():
+        entry = history[pos]
+        if 'action' in fields:
+            fields = dict(fields, previous_action=entry.get('action'), reconciled=now)
+            # Likes and removals made in the app label the relevance filter too
+            record_feedback(client.relevance_model, fields.get('album_id', entry.get('album_id')), fields['action'], entry)
+        entry.update(fields)
+    history.extend(new_entries)
+    profile = client.profile
+    save_history(history, profile.processed_log_path)
+    save_model(client.relevance_model, profile.model_path)
+
+    if stale and discovery_pl is not None:
+        index = client.library_index
+        playlist_name = profile.playlist_name
+        track_ids = [t for a in sorted(stale) for t in index['playlist_albums'].get(playlist_name, {}).get(a, [])]
+        print(f"  > Removing {len(track_ids)} tracks of {len(stale)} stale albums from '{playlist_name}'...")
+        try:
+            with span("tidal.playlist_write", "tidal", playlist=playlist_name, tracks=len(track_ids)):
+                discovery_pl.delete_by_id(track_ids)
+            for album_id in stale:
+                forget_playlist_album(index, playlist_name, album_id)
+        except Exception as e:
+            print(f"    - Batch removal failed: {e}")
+
+def build_report(drift, history_len, elapsed, dry_run):
+    return {
+        "timestamp": time.time(),
+        "dry_run": dry_run,
+        "history_entries": history_len,
+        "elapsed_s": round(elapsed, 2),
+        "counts": {k: len(v) for k, v in drift.items()},
+        "samples": {k: v[:REPORT_SAMPLE_SIZE] for k, v in drift.items() if v},
+    }
+
+def save_report(report, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+# --- Main Function ---
+def reconcile(dry_run=False, profile=None):
+    """Brings the profile's processed_albums.json back in line with what is actually in Tidal."""
+    print(f"ReconcileAgent: Starting{' (dry run)' if dry_run else ''}...")
+    started = time.time()
+    try:
+        client = RealTidalClient(profile=profile)
+    except Exception:
+        return None
+
+    profile = client.profile
+    client.relevance_model = load_model(profile.model_path)
+    history = client.history
+    playlists = find_playlists(client, [profile.playlist_name, REMOVE_CMD_PLAYLIST, PROMOTE_CMD_PLAYLIST])
+    print(f"  > Pulling favorites and {len(playlists)} playlists...")
+    index = pull_live_state(client, playlists)
+
+    drift, updates, new_entries, stale = compute_drift(history, index, profile.playlist_name)
+    if not dry_run:
+        apply_corrections(client, history, updates, new_entries, stale, playlists.get(profile.playlist_name))
+        save_library_index(index, profile.library_index_path)
+
+    report = build_report(drift, len(history), time.time() - started, dry_run)
+    print(f"  > Checked {len(history)} history entries against {len(index['favorites'])} favorites "
+          f"in {report['elapsed_s']}s.")
+    for category, count in report['counts'].items():
+        if count:
+            print(f"    - {category}: {count}")
+    if dry_run:
+        # A dry run writes nothing, not even the report: the drift goes to the log instead
+        for category, sample in report['samples'].items():
+            print(f"  > {category}:")
+            for entry in sample:
+                print(f"    - {json.dumps(entry, ensure_ascii=False)}")
+        print("ReconcileAgent: Done (dry run, nothing written).")
+        return report
+    save_report(report, profile.reconcile_report_path)
+    print(f"ReconcileAgent: Done. Report saved to {profile.reconcile_report_path}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile processed_albums.json with live Tidal state.")
+    parser.add_argument("--dry-run", action="store_true", help="Print drift without changing Tidal or writing any file.")
+    reconcile(dry_run=parser.parse_args().dry_run)
@@ -0,0 +1,357 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import time
+import zlib
+
+# --- Configuration ---
+MODEL_FILE_PATH = 'data/relevance_model.json'  # the default profile's; see Profile.model_path / replay_path
+REPLAY_FILE_PATH = '.cache/relevance_replay.json'  # not committed (rewritten every run); CI keeps it with actions/cache
+PROCESSED_LOG_PATH = 'data/processed_albums.json'  # the default profile's; the retrain CLI takes --profile
+RUN_LOG_PATH = 'data/run_log.txt'
+CHUNK_CHARS = 1500            # page text is scored in windows of about this size
+LEARNING_RATE = 0.2
+L2 = 1e-4
+EPOCHS = 8                    # passes over history + replay buffer for an offline retrain
+MAX_TOKENS_PER_EXAMPLE = 300
+REPLAY_SIZE = 1500            # recent examples kept so an offline retrain doesn't forget Gemini's chunk labels
+MAX_PENDING = 5000            # albums in the discovery playlist still waiting for a cleanup command
+MIN_EXAMPLES = 200            # the gate stays open (everything goes to Gemini) until the model has seen this many...
+MIN_PER_CLASS = 30            # ...with at least this many of each label
+SKIP_BELOW = 0.15             # P(relevant) under which a chunk is not sent to Gemini (default; set per profile)
+SHADOW_RUNS = 3               # a ready model only scores (everything still goes to Gemini) until the last N runs show...
+MIN_SKIP_SHARE = 0.10         # ...it would skip at least this share of chunks...
+MAX_MISS_RATE = 0.05          # ...and Gemini found albums in at most this share of the ones it would skip
+AUDIT_PERCENT = 10            # share of would-be-skipped chunks sent anyway, so agreement stats stay honest
+FEEDBACK_WEIGHT = 3.0         # a cleanup command counts this many times a Gemini-derived chunk label
+MAX_RUNS_KEPT = 50
+MIN_WEIGHT_KEPT = 1e-3        # smaller weights are pruned when the model is saved
+
+POSITIVE_ACTIONS = {"LIKE_IMMEDIATELY", "LIKED_VIA_PLAYLIST", "LIKED_IN_APP"}
+NEGATIVE_ACTIONS = {"EXCLUDED_VIA_PLAYLIST", "REMOVED_IN_APP", "UNLIKED_IN_APP"}
+STOPWORDS = set("""the and for with from that this are was were you your their they them its his her has have had not but
+all any can will just more most some into over than then there here what when where which who how our out about also
+been being after before new album albums read more record records release releases track tracks song songs""".split())
+
+# --- Model file ---
+# {
+#   "bias": float, "weights": {token: float},
+#   "examples": n, "positives": n, "negatives": n,
+#   "pending": {album id: [tokens]},   # features of albums added to the playlist, labeled later by cleanup
+#   "runs": [gate stats per analysis run],
+#   "trained": unix timestamp of the last offline retrain
+# }
+# A small online logistic regression over word tokens. It never sees an album Gemini
+# didn't first pick out of a page, so it acts as a pre-filter on page text: chunks it is
+# confident are irrelevant (navigation, genres the user never keeps) don't go to Gemini.
+# Recent Gemini chunk labels ([label, [tokens]]) live in a separate replay file that only the
+# analysis stage and an offline retrain read, so cleanup commands stay cheap. Feedback labels
+# need no replay: they are rebuilt from processed_albums.json.
+# Feedback and history examples are album text (artist, title, Gemini's reasoning), while the
+# gate scores raw page chunks, so a good training accuracy says little about the gate. That is
+# why a retrained model starts over in shadow mode: only chunk-level agreement stats gathered
+# after the retrain (see gate_mode) can switch skipping on.
+
+def _new_model():
+    return {"bias": 0.0, "weights": {}, "examples": 0, "positives": 0, "negatives": 0,
+            "pending": {}, "runs": [], "trained": 0}
+
+def load_model(path=MODEL_FILE_PATH):
+    try:
+        with open(path, 'r') as f:
+            model = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _new_model()
+    for key, value in _new_model().items():
+        model.setdefault(key, value)
+    return model
+
+def save_model(model, path=MODEL_FILE_PATH):
+    model['weights'] = {t: round(w, 4) for t, w in model['weights'].items() if abs(w) >= MIN_WEIGHT_KEPT}
+    model['bias'] = round(model['bias'], 4)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(json.dumps(model))  # one C-encoder call; json.dump streams through the slow Python encoder
+
+def load_replay(path=REPLAY_FILE_PATH):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+def save_replay(replay, path=REPLAY_FILE_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(json.dumps(replay[-REPLAY_SIZE:]))
+
+# --- Features ---
+def tokenize(text, source_name=None):
+    tokens = {t for t in re.findall(r"[a-z][a-z0-9'\-]{2,}", (text or '').lower()) if t not in STOPWORDS}
+    tokens = sorted(tokens)[:MAX_TOKENS_PER_EXAMPLE]
+    if source_name:
+        tokens.append(f"src:{source_name}")
+    return tokens
+
+def album_tokens(album_data):
+    """Features for a single album: artist, title, the AI reasoning (genre keywords) and source."""
+    text = f"{album_data.get('artist', '')} {album_data.get('album', '')} {album_data.get('reasoning', '')}"
+    return tokenize(text, album_data.get('source_name'))
+
+def split_chunks(text, size=CHUNK_CHARS):
+    """Splits page text into roughly size-char windows on word boundaries."""
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            space = text.rfind(' ', start + size // 2, end)
+            end = space if space > start else end
+        chunks.append(text[start:end].strip())
+        start = end
+    return [c for c in chunks if c]
+
+# --- Scoring & Learning ---
+def _sigmoid(z):
+    return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+def predict(model, tokens):
+    """P(relevant). Token weights are scaled by 1/sqrt(n) so long chunks and short reasoning texts score alike."""
+    if not tokens:
+        return _sigmoid(model['bias'])
+    weights = model['weights']
+    scale = 1.0 / math.sqrt(len(tokens))
+    return _sigmoid(model['bias'] + scale * sum(weights.get(t, 0.0) for t in tokens))
+
+def predict_batch(model, token_lists):
+    return [predict(model, tokens) for tokens in token_lists]
+
+def learn(model, tokens, label, weight=1.0):
+    """One SGD step of weighted logistic loss."""
+    weights = model['weights']
+    scale = 1.0 / math.sqrt(len(tokens)) if tokens else 0.0
+    gradient = (predict(model, tokens) - label) * weight
+    model['bias'] -= LEARNING_RATE * gradient
+    for t in tokens:
+        w = weights.get(t, 0.0)
+        weights[t] = w - LEARNING_RATE * (gradient * scale + L2 * w)
+    model['examples'] += 1
+    model['positives' if label else 'negatives'] += 1
+
+def is_ready(model):
+    return (model['examples'] >= MIN_EXAMPLES and model['positives'] >= MIN_PER_CLASS
+            and model['negatives'] >= MIN_PER_CLASS)
+
+def gate_mode(model):
+    """
+    "learning": too few labels, chunks aren't scored. "shadow": chunks are scored but all sent, so Gemini
+    labels every chunk the model would have skipped. "active": recent runs showed it would skip enough
+    chunks with few misses, so it skips them (minus the audit share, which keeps the evidence coming).
+    """
+    if not is_ready(model):
+        return "learning"
+    # Runs scored by a model from before the last offline retrain don't vouch for this one
+    recent = [r for r in model['runs']
+              if r.get('mode') in ("shadow", "active") and r.get('timestamp', 0) >= model['trained']][-SHADOW_RUNS:]
+    if len(recent) < SHADOW_RUNS:
+        return "shadow"
+    chunks = sum(r['chunks'] for r in recent)
+    would_skip = sum(r['would_skip'] for r in recent)
+    checked = sum(r['would_skip_checked'] for r in recent)
+    misses = sum(r['would_skip_misses'] for r in recent)
+    if not chunks or would_skip / chunks < MIN_SKIP_SHARE or not checked or misses / checked > MAX_MISS_RATE:
+        return "shadow"
+    return "active"
+
+# --- Feedback (Tidal + cleanup stages) ---
+def remember_candidate(model, album_id, album_data):
+    """Keeps the features of an album added to the playlist until a cleanup command labels it."""
+    pending = model['pending']
+    pending[str(album_id)] = album_tokens(album_data)
+    while len(pending) > MAX_PENDING:
+        pending.pop(next(iter(pending)))
+
+def record_feedback(model, album_id, action, album_data=None):
+    """Incremental retrain on one labeled outcome (a cleanup command or an immediate like)."""
+    if action in POSITIVE_ACTIONS:
+        label = 1
+    elif action in NEGATIVE_ACTIONS:
+        label = 0
+    else:
+        return False
+    tokens = model['pending'].pop(str(album_id), None) if album_id is not None else None
+    if tokens is None:
+        tokens = album_tokens(album_data or {})
+    if not tokens:
+        return False
+    weight = 1.0 if action == "LIKE_IMMEDIATELY" else FEEDBACK_WEIGHT
+    learn(model, tokens, label, weight)
+    return True
+
+# --- Page Gate (analysis stage) ---
+class RelevanceGate:
+    """
+    Decides, per page chunk, what goes to Gemini, and learns from what Gemini returns.
+    The model is frozen for the run; everything observed is applied in finish().
+    """
+    def __init__(self, model, skip_below=SKIP_BELOW, model_path=MODEL_FILE_PATH, replay_path=REPLAY_FILE_PATH):
+        self.model = model
+        self.skip_below = skip_below
+        self.model_path = model_path
+        self.replay_path = replay_path
+        self.mode = gate_mode(model)
+        self.examples = []
+        self.stats = {"timestamp": time.time(), "mode": self.mode, "pages": 0, "pages_skipped": 0,
+                      "chunks": 0, "chunks_sent": 0, "chunks_skipped": 0, "chunks_audited": 0,
+                      "chars_skipped": 0, "agree": 0, "disagree": 0,
+                      "true_pos": 0, "false_pos": 0, "true_neg": 0, "false_neg": 0,
+                      "would_skip": 0, "would_skip_checked": 0, "would_skip_misses": 0}
+
+    def filter_page(self, page_text, source_name, max_chars):
+        """Returns (text to send, chunks). Empty text means the whole page was skipped."""
+        chunks = []
+        for text in split_chunks(page_text):
+            tokens = tokenize(text, source_name)
+            chunks.append({"text": text, "tokens": tokens, "p": None, "below": False, "sent": False, "audit": False})
+        if self.mode != "learning":
+            for chunk, p in zip(chunks, predict_batch(self.model, [c['tokens'] for c in chunks])):
+                chunk['p'] = p
+                chunk['below'] = p < self.skip_below
+
+        sent_chars = 0
+        for chunk in chunks:
+            self.stats['would_skip'] += chunk['below']
+            keep = not chunk['below'] or self.mode != "active"
+            if not keep and zlib.crc32(chunk['text'].encode('utf-8')) % 100 < AUDIT_PERCENT:
+                keep = chunk['audit'] = True
+            if keep and sent_chars + len(chunk['text']) <= max_chars:
+                chunk['sent'] = True
+                sent_chars += len(chunk['text']) + 1
+            elif not keep:
+                self.stats['chunks_skipped'] += 1
+                self.stats['chars_skipped'] += len(chunk['text'])
+
+        sent = [c for c in chunks if c['sent']]
+        self.stats['pages'] += 1
+        self.stats['chunks'] += len(chunks)
+        self.stats['chunks_sent'] += len(sent)
+        self.stats['chunks_audited'] += sum(1 for c in sent if c['audit'])
+        if not sent:
+            self.stats['pages_skipped'] += 1
+        return ' '.join(c['text'] for c in sent), chunks
+
+    def observe(self, chunks, albums):
+        """Labels each chunk Gemini saw by whether an approved album's artist appears in it."""
+        artists = [a.get('artist', '').lower() for a in albums if a.get('artist')]
+        for chunk in chunks:
+            if not chunk['sent']:
+                continue
+            text = chunk['text'].lower()
+            label = 1 if any(artist in text for artist in artists) else 0
+            self.examples.append((label, chunk['tokens']))
+            if chunk['p'] is None:
+                continue
+            predicted = 1 if chunk['p'] >= 0.5 else 0
+            self.stats['agree' if predicted == label else 'disagree'] += 1
+            self.stats[('true_' if predicted == label else 'false_') + ('pos' if predicted else 'neg')] += 1
+            if chunk['below']:
+                self.stats['would_skip_checked'] += 1
+                self.stats['would_skip_misses'] += label
+
+    def finish(self):
+        """Applies this run's chunk labels to the model, stores the run's stats and saves. Returns the stats."""
+        # Re-read first: cleanup feedback may have been saved while this run was waiting on Gemini
+        self.model = load_model(self.model_path)
+        for label, tokens in self.examples:
+            learn(self.model, tokens, label)
+        if self.examples:
+            save_replay(load_replay(self.replay_path) + [[label, tokens] for label, tokens in self.examples], self.replay_path)
+        judged = self.stats['agree'] + self.stats['disagree']
+        self.stats['agreement'] = round(self.stats['agree'] / judged, 3) if judged else None
+        self.stats['trained_examples'] = self.model['examples']
+        self.model['runs'].append(self.stats)
+        self.model['runs'] = self.model['runs'][-MAX_RUNS_KEPT:]
+        save_model(self.model, self.model_path)
+        return self.stats
+
+def latest_gate_run(path=MODEL_FILE_PATH):
+    runs = load_model(path)['runs']
+    return runs[-1] if runs else None
+
+# --- Offline Training ---
+def load_reasoning_log(path=RUN_LOG_PATH):
+    """
+    Maps lowercased "artist::album" -> the first AI reasoning logged for it in run_log.txt.
+    SKIPPED_* lines are left out: their "Skipped: Already processed..." text is ours, not Gemini's.
+    """
+    pattern = re.compile(r"^\[(\w+)\].*?\| Artist: '(.*?)' \| Looking for: '(.*?)' \|.*?\| Reason: (.*)$")
+    reasons = {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = pattern.search(line)
+                if match and not match.group(1).startswith("SKIPPED_"):
+                    reasons.setdefault(f"{match.group(2)}::{match.group(3)}".lower(), match.group(4).strip())
+    except FileNotFoundError:
+        pass
+    return reasons
+
+def history_examples(history_path=PROCESSED_LOG_PATH, run_log_path=RUN_LOG_PATH):
+    """(label, weight, tokens) for every history entry with a usable outcome."""
+    try:
+        with open(history_path, 'r') as f:
+            history = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        history = []
+    reasons = load_reasoning_log(run_log_path)
+    examples = []
+    for entry in history:
+        action = entry.get('action')
+        if action not in POSITIVE_ACTIONS and action not in NEGATIVE_ACTIONS:
+            continue
+        album_data = {"artist": entry.get('artist'), "album": entry.get('album'),
+                      "reasoning": reasons.get(str(entry.get('key', '')).lower(), ''),
+                      "source_name": entry.get('source_name')}
+        weight = 1.0 if action == "LIKE_IMMEDIATELY" else FEEDBACK_WEIGHT
+        examples.append((1 if action in POSITIVE_ACTIONS else 0, weight, album_tokens(album_data)))
+    return examples
+
+def retrain(model, history_path=PROCESSED_LOG_PATH, run_log_path=RUN_LOG_PATH, replay_path=REPLAY_FILE_PATH):
+    """Rebuilds the weights from history labels plus the replayed Gemini chunk labels."""
+    examples = history_examples(history_path, run_log_path)
+    examples += [(label, 1.0, tokens) for label, tokens in load_replay(replay_path)]
+    fresh = _new_model()
+    fresh.update(pending=model['pending'], runs=model['runs'])
+    rng = random.Random(0)
+    for _ in range(EPOCHS):
+        rng.shuffle(examples)
+        for label, weight, tokens in examples:
+            learn(fresh, tokens, label, weight)
+    fresh['examples'] = len(examples)
+    fresh['positives'] = sum(1 for e in examples if e[0])
+    fresh['negatives'] = len(examples) - fresh['positives']
+    fresh['trained'] = time.time()
+    correct = sum(1 for label, _, tokens in examples if (predict(fresh, tokens) >= 0.5) == bool(label))
+    return fresh, (correct / len(examples) if examples else None)
+
+if __name__ == "__main__":
+    from agent_profile import Profile
+    parser = argparse.ArgumentParser(description="Retrain the relevance gate from a profile's history and replay buffer.")
+    parser.add_argument("--profile", help="Profile name from config/profiles.json (default: the original setup in data/).")
+    args = parser.parse_args()
+    profile = Profile()
+    if args.profile:
+        from profile_runner import load_profiles
+        profile = next((p for p in load_profiles() if p.name == args.profile), None)
+        if profile is None:
+            parser.error(f"no enabled profile named '{args.profile}'")
+
+    print(f"RelevanceModel: Retraining '{profile.name}' from history and replay buffer...")
+    trained, accuracy = retrain(load_model(profile.model_path), profile.processed_log_path,
+                                profile.run_log_path, profile.replay_path)
+    save_model(trained, profile.model_path)
+    print(f"  > {trained['examples']} examples ({trained['positives']} relevant / {trained['negatives']} not), "
+          f"{len(trained['weights'])} weights. Training accuracy: {accuracy if accuracy is None else f'{accuracy:.1%}'}")
+    print(f"  > Gate mode: {gate_mode(trained)}. Saved to {profile.model_path}")
@@ -0,0 +1,169 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# --- Configuration ---
+SNAPSHOT_DIR = 'data/snapshots'
+OBJECTS_DIR = 'data/snapshots/objects'
+RUNS_FILE_PATH = 'data/snapshots/runs.json'
+# Hand-off files whose references must survive a GC even if their run has aged out
+HANDOFF_FILES = ['data/raw_album_list.json', 'data/filtered_album_list.json', 'data/profiles/*/filtered_album_list.json']
+RETAIN_RUNS = 30          # snapshots from this many most recent stage runs are kept...
+RETAIN_DAYS = 14          # ...as well as anything referenced in the last N days
+COMPRESS_LEVEL = 6
+TMP_GRACE_SECONDS = 3600  # GC leaves younger .tmp files alone: another process may still be writing them
+
+# --- Layout ---
+# data/snapshots/objects/<sha256[:2]>/<sha256[2:]>.gz   gzip of the UTF-8 content (mtime 0, so identical
+#                                                       content is byte-identical and git stores it once)
+# data/snapshots/runs.json                              [{"timestamp", "stage", "refs": {name: sha256}}]
+# A page that didn't change since the last harvest hashes to an existing object and writes nothing.
+# Objects are written to a uniquely named <random>.tmp in the same folder and renamed into place,
+# so concurrent writers (parallel profiles) never share a temp file or expose a partial object.
+
+def _object_path(ref):
+    return os.path.join(OBJECTS_DIR, ref[:2], ref[2:] + '.gz')
+
+def put_text(text):
+    """Stores text (if new) and returns its content hash."""
+    data = text.encode('utf-8')
+    ref = hashlib.sha256(data).hexdigest()
+    path = _object_path(ref)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            try:
+                f.write(gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0))
+            except BaseException:
+                f.close()
+                os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, path)
+    return ref
+
+def get_text(ref):
+    with open(_object_path(ref), 'rb') as f:
+        return gzip.decompress(f.read()).decode('utf-8')
+
+def put_json(obj):
+    return put_text(json.dumps(obj, separators=(',', ':'), ensure_ascii=False))
+
+def get_json(ref):
+    return json.loads(get_text(ref))
+
+def has_object(ref):
+    return os.path.exists(_object_path(ref))
+
+# --- Hand-off helpers ---
+def page_text(page):
+    """Page text from a raw_album_list.json entry (page_ref, or inline page_text from older runs)."""
+    if page.get('page_ref'):
+        try:
+            return get_text(page['page_ref'])
+        except FileNotFoundError:
+            print(f"  > [Snapshots] Missing blob {page['page_ref'][:12]} for {page.get('source_name')}.")
+            return ""
+    return page.get('page_text', "")
+
+def write_handoff(path, name, obj, **fields):
+    """Stores obj as a blob and writes a small hand-off file pointing at it. Returns the ref."""
+    ref = put_json(obj)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(dict(fields, snapshot=ref, name=name), f, indent=2)
+    return ref
+
+def read_handoff(path):
+    """Loads what write_handoff stored. Plain JSON files from before the snapshot store are returned as-is."""
+    with open(path, 'r') as f:
+        handoff = json.load(f)
+    if isinstance(handoff, dict) and 'snapshot' in handoff:
+        return get_json(handoff['snapshot'])
+    return handoff
+
+# --- Run manifests ---
+def load_runs():
+    try:
+        with open(RUNS_FILE_PATH, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+def record_run(stage, refs):
+    """Appends a manifest of the snapshots one stage run produced (refs: {name: ref})."""
+    runs = load_runs()
+    runs.append({"timestamp": time.time(), "stage": stage, "refs": refs})
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(RUNS_FILE_PATH, 'w') as f:
+        json.dump(runs, f, indent=1)
+
+# --- Garbage Collection ---
+def _handoff_refs():
+    refs = set()
+    for path in (p for pattern in HANDOFF_FILES for p in glob.glob(pattern)):
+        try:
+            with open(path, 'r') as f:
+                handoff = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        entries = handoff if isinstance(handoff, list) else [handoff]
+        refs.update(e[k] for e in entries if isinstance(e, dict) for k in ('page_ref', 'snapshot') if e.get(k))
+    return refs
+
+def collect_garbage(retain_runs=RETAIN_RUNS, retain_days=RETAIN_DAYS, dry_run=False):
+    """
+    Drops run manifests outside the retention window, then deletes every object
+    no remaining manifest or hand-off file references, plus .tmp files abandoned for
+    longer than TMP_GRACE_SECONDS. Returns (objects deleted, bytes freed).
+    """
+    runs = load_runs()
+    cutoff = time.time() - retain_days * 86400
+    kept = [r for i, r in enumerate(runs) if i >= len(runs) - retain_runs or r['timestamp'] >= cutoff]
+    live = _handoff_refs()
+    for run in kept:
+        live.update(run['refs'].values())
+
+    deleted, freed = 0, 0
+    if os.path.isdir(OBJECTS_DIR):
+        for prefix in sorted(os.listdir(OBJECTS_DIR)):
+            folder = os.path.join(OBJECTS_DIR, prefix)
+            for name in sorted(os.listdir(folder)):
+                path = os.path.join(folder, name)
+                if name.endswith('.gz'):
+                    if prefix + name[:-len('.gz')] in live:
+                        continue
+                elif not name.endswith('.tmp') or time.time() - os.path.getmtime(path) < TMP_GRACE_SECONDS:
+                    continue  # not ours, or a write still in flight
+                deleted += 1
+                freed += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+            if not dry_run and not os.listdir(folder):
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    pass  # a writer just created something in it
+
+    if not dry_run and len(kept) != len(runs):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(RUNS_FILE_PATH, 'w') as f:
+            json.dump(kept, f, indent=1)
+    print(f"SnapshotStore: {'Would delete' if dry_run else 'Deleted'} {deleted} objects ({freed / 1024:.1f} KB); "
+          f"kept {len(live)} live objects from {len(kept)} of {len(runs)} runs.")
+    return deleted, freed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed snapshot store in data/snapshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    gc_parser = sub.add_parser("gc", help="Prune snapshots outside the retention window.")
+    gc_parser.add_argument("--keep-runs", type=int, default=RETAIN_RUNS)
+    gc_parser.add_argument("--keep-days", type=int, default=RETAIN_DAYS)
+    gc_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    collect_garbage(args.keep_runs, args.keep_days, args.dry_run)
@@ -0,0 +1,213 @@
+import json
+import os
+
+from llm_usage import load_usage_history, MAX_TOKENS_PER_RUN, MAX_REQUESTS_PER_RUN
+
+# --- Configuration ---
+STATS_FILE_PATH = 'data/source_stats.json'
+SOURCES_FILE_PATH = 'config/sources.json'
+PRIOR_ALBUMS_PER_CALL = 3.5    # what a relevancy_score 10 source is assumed to yield before we have data
+PRIOR_WEIGHT = 3               # how many calls of evidence the prior is worth
+MIN_CALLS_BEFORE_SKIP = 4      # never skip a source we have barely seen
+MIN_EXPECTED_VALUE = 0.25      # expected matched albums per call below which a source is skipped
+REPROBE_INTERVAL_RUNS = 6      # skipped sources get one probe every N runs
+DEFAULT_TOKENS_PER_CALL = 4000 # estimate for sources with no usage history yet
+# Fetch timeouts and circuit breaker
+DEFAULT_TIMEOUT_S = 15         # used until a source has MIN_LATENCY_SAMPLES
+MIN_TIMEOUT_S = 3
+MAX_TIMEOUT_S = 30
+CONNECT_TIMEOUT_S = 5
+TIMEOUT_LATENCY_FACTOR = 3     # timeout = p95 latency x this (plus 1s slack), clamped to the bounds above
+MIN_LATENCY_SAMPLES = 3
+LATENCY_SAMPLES_KEPT = 20
+BREAKER_FAILURE_THRESHOLD = 3  # consecutive failed fetches that open a source's breaker
+BREAKER_COOLDOWN_RUNS = 2      # runs an open breaker waits before a half-open probe...
+BREAKER_MAX_COOLDOWN_RUNS = 16 # ...doubling after each failed probe, up to this
+
+# --- Stats Store ---
+def _new_entry():
+    return {
+        "fetches": 0, "fetch_failures": 0,
+        "llm_calls": 0, "approved_albums": 0,
+        "tidal_attempts": 0, "tidal_matches": 0,
+        "last_run": 0, "skipped_runs": 0,
+        "latencies_ms": [], "consecutive_failures": 0,
+        "breaker": "closed", "breaker_opened_run": 0, "breaker_cooldown_runs": BREAKER_COOLDOWN_RUNS,
+    }
+
+def load_source_stats(path=STATS_FILE_PATH):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"runs": 0, "sources": {}}
+
+def save_source_stats(stats, path=STATS_FILE_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=2)
+
+def source_entry(stats, source_name):
+    entry = stats['sources'].setdefault(source_name, _new_entry())
+    for key, value in _new_entry().items():
+        entry.setdefault(key, value)
+    return entry
+
+def record_fetch(stats, source_name, ok, latency_ms=None):
+    """
+    Records one fetch and moves the source's circuit breaker:
+    closed --(N failures in a row)--> open --(cooldown runs)--> half_open --(probe ok)--> closed,
+    and a failed half-open probe re-opens it with a doubled cooldown.
+    Timed-out fetches should pass the timeout as latency_ms, so slow sources earn longer timeouts.
+    """
+    entry = source_entry(stats, source_name)
+    entry['fetches'] += 1
+    entry['last_run'] = stats['runs']
+    if latency_ms is not None:
+        entry['latencies_ms'] = (entry['latencies_ms'] + [round(latency_ms)])[-LATENCY_SAMPLES_KEPT:]
+    if ok:
+        entry['consecutive_failures'] = 0
+        entry['breaker'] = "closed"
+        entry['breaker_cooldown_runs'] = BREAKER_COOLDOWN_RUNS
+        return
+    entry['fetch_failures'] += 1
+    entry['consecutive_failures'] += 1
+    if entry['breaker'] == "half_open":
+        entry['breaker'] = "open"
+        entry['breaker_opened_run'] = stats['runs']
+        entry['breaker_cooldown_runs'] = min(entry['breaker_cooldown_runs'] * 2, BREAKER_MAX_COOLDOWN_RUNS)
+    elif entry['consecutive_failures'] >= BREAKER_FAILURE_THRESHOLD:
+        entry['breaker'] = "open"
+        entry['breaker_opened_run'] = stats['runs']
+
+def record_analysis(stats, source_name, approved_count):
+    entry = source_entry(stats, source_name)
+    entry['llm_calls'] += 1
+    entry['approved_albums'] += approved_count
+
+def record_tidal_result(stats, source_name, matched):
+    entry = source_entry(stats, source_name)
+    entry['tidal_attempts'] += 1
+    if matched:
+        entry['tidal_matches'] += 1
+
+YIELD_FIELDS = ('llm_calls', 'approved_albums', 'tidal_attempts', 'tidal_matches')
+
+def yield_delta(before, after):
+    """Per-source change in the yield counters between two snapshots of the stats (a profile run's private copy)."""
+    delta = {}
+    for name, entry in after['sources'].items():
+        old = before['sources'].get(name, {})
+        changes = {k: entry.get(k, 0) - old.get(k, 0) for k in YIELD_FIELDS}
+        if any(changes.values()):
+            delta[name] = changes
+    return delta
+
+def merge_yields(stats, delta):
+    for name, changes in delta.items():
+        entry = source_entry(stats, name)
+        for key, value in changes.items():
+            entry[key] += value
+
+# --- Timeouts & Circuit Breaker ---
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def fetch_timeout(entry):
+    """(connect, read) timeout in seconds, adapted from the source's recent latency."""
+    samples = entry.get('latencies_ms') or []
+    if len(samples) < MIN_LATENCY_SAMPLES:
+        read = DEFAULT_TIMEOUT_S
+    else:
+        read = _percentile(samples, 95) / 1000 * TIMEOUT_LATENCY_FACTOR + 1
+        read = round(max(MIN_TIMEOUT_S, min(MAX_TIMEOUT_S, read)), 1)
+    return (min(CONNECT_TIMEOUT_S, read), read)
+
+def latency_summary(entry):
+    samples = entry.get('latencies_ms') or []
+    if not samples:
+        return None
+    return {"p50_ms": _percentile(samples, 50), "p95_ms": _percentile(samples, 95), "samples": len(samples)}
+
+def breaker_allows(stats, entry):
+    """
+    Whether the source may be fetched this run. An open breaker whose cooldown has
+    passed turns half_open and lets exactly this run's fetch through as a probe.
+    """
+    if entry['breaker'] == "open" and stats['runs'] - entry['breaker_opened_run'] >= entry['breaker_cooldown_runs']:
+        entry['breaker'] = "half_open"
+    return entry['breaker'] != "open"
+
+# --- Scoring ---
+def expected_value(entry, relevancy_score):
+    """
+    Expected Tidal-matched albums per LLM call for a source.
+    Approvals per call are smoothed towards a prior derived from relevancy_score,
+    then discounted by the (Laplace-smoothed) Tidal match and fetch success rates.
+    """
+    prior = PRIOR_ALBUMS_PER_CALL * (relevancy_score or 0) / 10
+    approved_per_call = (entry['approved_albums'] + PRIOR_WEIGHT * prior) / (entry['llm_calls'] + PRIOR_WEIGHT)
+    match_rate = (entry['tidal_matches'] + 1) / (entry['tidal_attempts'] + 2)
+    fetch_rate = (entry['fetches'] - entry['fetch_failures'] + 1) / (entry['fetches'] + 2)
+    return approved_per_call * match_rate * fetch_rate
+
+def average_tokens_per_call(usage_sources, source_name):
+    u = usage_sources.get(source_name)
+    if not u or not u.get('requests'):
+        return DEFAULT_TOKENS_PER_CALL
+    return (u['input_tokens'] + u['output_tokens']) // u['requests']
+
+def load_source_priorities():
+    """Maps source name -> expected value, for ordering already-harvested pages."""
+    try:
+        with open(SOURCES_FILE_PATH, 'r') as f:
+            sources = json.load(f).get('sources', [])
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    stats = load_source_stats()
+    return {s.get('website'): expected_value(source_entry(stats, s.get('website')), s.get('relevancy_score', 0)) for s in sources}
+
+# --- Scheduler ---
+def schedule_sources(sources, stats, max_requests=MAX_REQUESTS_PER_RUN, max_tokens=MAX_TOKENS_PER_RUN):
+    """
+    Orders sources by expected value and decides which to fetch this run, after
+    dropping sources whose circuit breaker is open. Starts a new run in `stats`. Returns (scheduled, skipped) where skipped is a
+    list of (source, reason). Every analyzed page costs one 60s-throttled call,
+    so the request budget doubles as the run's time budget.
+    """
+    stats['runs'] += 1
+    run = stats['runs']
+    usage_sources = load_usage_history().get('sources', {})
+
+    ranked = []
+    for source in sources:
+        entry = source_entry(stats, source['website'])
+        value = expected_value(entry, source.get('relevancy_score', 0))
+        ranked.append((value, source, entry))
+    ranked.sort(key=lambda r: r[0], reverse=True)
+
+    scheduled, skipped = [], []
+    requests_left, tokens_left = max_requests, max_tokens
+    for value, source, entry in ranked:
+        name = source['website']
+        if not breaker_allows(stats, entry):
+            runs_left = entry['breaker_cooldown_runs'] - (run - entry['breaker_opened_run'])
+            skipped.append((source, f"Circuit breaker open after {entry['consecutive_failures']} failed fetches in a row. Half-open probe in {runs_left} runs."))
+            entry['skipped_runs'] += 1
+            continue
+        reprobe_due = run - entry['last_run'] >= REPROBE_INTERVAL_RUNS
+        low_yield = entry['llm_calls'] >= MIN_CALLS_BEFORE_SKIP and value < MIN_EXPECTED_VALUE
+        if low_yield and not reprobe_due and entry['breaker'] != "half_open":
+            skipped.append((source, f"Low yield ({value:.2f} expected albums/call). Re-probe in {REPROBE_INTERVAL_RUNS - (run - entry['last_run'])} runs."))
+            entry['skipped_runs'] += 1
+            continue
+        tokens = average_tokens_per_call(usage_sources, name)
+        if (max_requests and requests_left <= 0) or (max_tokens and tokens > tokens_left):
+            skipped.append((source, f"Over run budget ({value:.2f} expected albums/call, ~{tokens} tokens)."))
+            entry['skipped_runs'] += 1
+            continue
+        requests_left -= 1
+        tokens_left -= tokens
+        scheduled.append(source)
+    return scheduled, skipped
@@ -0,0 +1,131 @@
+import json
+
+# --- Album Schema ---
+# What the analyzer prompt asks Gemini to return, one object per album inside a JSON list.
+ALBUM_TEXT_FIELDS = ('artist', 'album', 'reasoning')
+VALID_DECISIONS = {"LIKE_IMMEDIATELY", "ADD_TO_PLAYLIST", "REVIEW_MANUALLY"}
+MIN_SCORE = 0
+MAX_SCORE = 100
+
+def validate_album(record):
+    """Returns (album, None) with fields normalized, or (None, reason) if the record breaks the schema."""
+    if not isinstance(record, dict):
+        return None, f"expected an object, got {type(record).__name__}"
+    album = dict(record)
+    for field in ALBUM_TEXT_FIELDS:
+        value = album.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, f"'{field}' must be a non-empty string"
+        album[field] = value.strip()
+
+    score = album.get('relevance_score')
+    if isinstance(score, str):
+        try:
+            score = float(score.strip())
+        except ValueError:
+            return None, f"'relevance_score' is not a number: {score!r}"
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        return None, "'relevance_score' must be a number"
+    if not MIN_SCORE <= score <= MAX_SCORE:
+        return None, f"'relevance_score' {score} is outside {MIN_SCORE}-{MAX_SCORE}"
+    album['relevance_score'] = int(score) if score == int(score) else score
+
+    decision = album.get('decision')
+    decision = decision.strip().upper() if isinstance(decision, str) else decision
+    if decision not in VALID_DECISIONS:
+        return None, f"'decision' must be one of {', '.join(sorted(VALID_DECISIONS))}, got {album.get('decision')!r}"
+    album['decision'] = decision
+    return album, None
+
+# --- Incremental Parser ---
+class AlbumStreamParser:
+    """
+    Pulls album objects out of a streamed JSON list as soon as each one closes, so a response
+    that is cut off or goes wrong halfway still yields every complete record before the damage.
+    Code fences and stray prose around the list are skipped (objects are only read once the
+    list's '[' is seen); strings are tracked only inside it, so apostrophes in prose don't
+    confuse it. A malformed object is rescanned from just after its '{' rather than dropped
+    whole, so an album that a broken one swallowed is still recovered.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0            # next character to scan
+        self.stack = []         # open '[' / '{' of the JSON being read
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+        self.valid = 0
+        self.invalid = []       # reasons, for the log
+
+    def feed(self, text):
+        """Adds a chunk of response text. Returns the albums it completed (validated)."""
+        self.buffer += text
+        albums = []
+        buffer, stack = self.buffer, self.stack
+        i = self.pos
+        while i < len(buffer):
+            char = buffer[i]
+            i += 1
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif not stack:
+                if char == '[':
+                    stack.append(char)  # the list starts; everything before it is prose
+            elif char == '"':
+                self.in_string = True
+            elif char in '[{':
+                # An album is an object directly inside the top-level list
+                if char == '{' and stack == ['[']:
+                    self.object_start = i - 1
+                stack.append(char)
+            elif char in ']}':
+                opener = '[' if char == ']' else '{'
+                if opener not in stack:
+                    continue  # a bracket in prose; nothing of ours to close
+                while stack.pop() != opener:
+                    pass      # malformed nesting: close whatever was left open inside
+                if self.object_start is not None and stack in ([], ['[']):
+                    start, self.object_start = self.object_start, None
+                    record, error = None, "closed by ']'"
+                    if char == '}':
+                        try:
+                            record, error = json.loads(buffer[start:i]), None
+                        except json.JSONDecodeError as e:
+                            error = e.msg
+                    if error:
+                        self.invalid.append(f"malformed object ({error})")
+                        # Resynchronise just after the broken object's '{', so a complete album
+                        # it swallowed (e.g. after an unclosed '{') is still found
+                        i = start + 1
+                        stack[:] = ['[']
+                        continue
+                    album = self._record(record)
+                    if album is not None:
+                        albums.append(album)
+        self.pos = len(buffer)
+        # Keep only what an unfinished object still needs
+        keep_from = self.object_start if self.object_start is not None else self.pos
+        self.buffer = buffer[keep_from:]
+        self.pos -= keep_from
+        if self.object_start is not None:
+            self.object_start = 0
+        return albums
+
+    def _record(self, record):
+        album, error = validate_album(record)
+        if error:
+            label = f"{record.get('artist')} - {record.get('album')}" if isinstance(record, dict) else "?"
+            self.invalid.append(f"{label}: {error}")
+            return None
+        self.valid += 1
+        return album
+
+    @property
+    def truncated(self):
+        """True if the response ended inside the list (e.g. the output limit cut it off)."""
+        return bool(self.stack)
@@ -1,33 +1,46 @@
+import contextlib
 import json
 import os
+import queue
+import threading
 import time
 import requests
 from dotenv import load_dotenv
 from tidalapi import Session, Quality
 import tidalapi
 from fuzzywuzzy import fuzz
+import tracing
+from tracing import span
+from llm_usage import latest_run, estimate_cost
+from snapshot_store import read_handoff
+from relevance_model import load_model, save_model, record_feedback, remember_candidate, latest_gate_run
+from source_stats import load_source_stats, save_source_stats, record_tidal_result, fetch_timeout, latency_summary
+from library_index import (load_library_index, save_library_index, remember_playlist, record_playlist_album, cached_playlist,
+                           record_favorite, refresh_favorites, refresh_playlist, is_favorite, in_playlist, library_album_keys, album_key)
+from agent_profile import Profile
+from processed_log import load_history, save_history
 
 # --- Configuration ---
-INPUT_FILE_PATH = 'data/filtered_album_list.json'
-HARVESTER_LOG_PATH = 'data/harvester_log.json'
-PROCESSED_LOG_PATH = 'data/processed_albums.json' 
-LOG_FILE_PATH = 'data/run_log.txt'
-REPORT_FILE_PATH = 'data/index.html'
-OUTPUT_DIR = 'data'
-PLAYLIST_NAME = "AI Music Discovery"
-MAX_LIKED_ALBUMS_PER_RUN = 5 
-FUZZY_MATCH_THRESHOLD = 85
+HARVESTER_LOG_PATH = 'data/harvester_log.json'  # shared harvest; history, report and playlist come from the Profile
+TRACE_PLACEHOLDER = "<!-- trace-summary -->"  # filled in by add_trace_summary() once the whole run has been traced
 
 # --- RealTidalClient Class ---
 class RealTidalClient:
-    def __init__(self):
+    def __init__(self, session=None, library_index=None, profile=None, history=None):
+        self.profile = profile or Profile()
+        # A long-running service passes in its already-authenticated session, shared index and history
+        if session is not None:
+            self.session = session
+            self.user = session.user
+            self.library_index = library_index if library_index is not None else load_library_index(self.profile.library_index_path)
+            self.history = history if history is not None else load_history(self.profile.processed_log_path)
+            self._playlists = {}
+            self._matches = {}
+            return
         self.session = Session()
-        # Load environment variables (TIDAL_* secrets) from .env if running locally
+        # Load environment variables (TIDAL_* secrets, or the profile's prefix) from .env if running locally
         load_dotenv(dotenv_path='config/.env') 
-        token_type = os.getenv("TIDAL_TOKEN_TYPE")
-        access_token = os.getenv("TIDAL_ACCESS_TOKEN")
-        refresh_token = os.getenv("TIDAL_REFRESH_TOKEN")
-        expiry_time = os.getenv("TIDAL_EXPIRY_TIME")
+        token_type, access_token, refresh_token, expiry_time = self.profile.tidal_credentials()
         if not all([token_type, access_token, refresh_token, expiry_time]):
             print("Error: Tidal auth tokens not found...")
             raise ValueError("Missing Tidal authentication")
@@ -44,29 +57,61 @@ class RealTidalClient:
         except Exception as e:
             print(f"Failed to authenticate with Tidal: {e}")
             raise
+        self.library_index = load_library_index(self.profile.library_index_path)
+        self.history = load_history(self.profile.processed_log_path)
+        self._playlists = {}
+        self._matches = {}  # (artist, album) -> find_album_id result, filled early by AlbumPrefetcher
+
+    def reset_playlist_cache(self):
+        """Forgets the playlist objects fetched so far (a long-lived client calls this per job: their track counts go stale)."""
+        self._playlists = {}
+
+    def reset_match_cache(self):
+        """Forgets prefetched search results once the Tidal stage has used them."""
+        self._matches = {}
 
     def get_playlist(self, name):
-        for pl in self.session.user.playlists():
-            if pl.name == name:
-                return pl
-        return None
+        # Same run: reuse the object. Known id: one lookup. Otherwise: list every playlist.
+        if name in self._playlists:
+            return self._playlists[name]
+        playlist = cached_playlist(self.session, self.library_index, name)
+        if playlist is None:
+            with span("tidal.list_playlists", "tidal"):
+                playlists = self.session.user.playlists()
+            playlist = next((pl for pl in playlists if pl.name == name), None)
+        if playlist is not None:
+            self._playlists[name] = playlist
+            remember_playlist(self.library_index, name, playlist.id)
+        return playlist
 
     def find_album_id(self, artist, album_to_find):
+        match = self._matches.get((artist, album_to_find))
+        if match is None:
+            match = self._search_album(artist, album_to_find)
+            if match['status'] != "ERROR":
+                self._matches[(artist, album_to_find)] = match
+        return match
+
+    def _search_album(self, artist, album_to_find):
         print(f"  > Searching Tidal for: '{album_to_find}' by '{artist}'...")
         try:
-            search_results = self.session.search(f"{artist} {album_to_find}", models=[tidalapi.Album])
+            with span("tidal.search", "tidal", artist=artist) as s:
+                search_results = self.session.search(f"{artist} {album_to_find}", models=[tidalapi.Album])
+                s.set(results=len(search_results['albums']) if search_results else 0)
             if not search_results or not search_results['albums']:
                 return {"id": None, "status": "NOT_FOUND", "title": album_to_find, "score": 0}
             best_match = None
             highest_score = 0
-            for tidal_album in search_results['albums'][:5]:
-                score = fuzz.token_sort_ratio(album_to_find, tidal_album.name)
-                if tidal_album.artist.name.lower() == artist.lower():
-                    score += 10
-                if score > highest_score:
-                    highest_score = score
-                    best_match = tidal_album
-            if highest_score > FUZZY_MATCH_THRESHOLD:
+            with span("tidal.match", "parse", artist=artist) as s:
+                for tidal_album in search_results['albums'][:5]:
+                    score = fuzz.token_sort_ratio(album_to_find, tidal_album.name)
+                    if tidal_album.artist.name.lower() == artist.lower():
+                        score += 10
+                    if score > highest_score:
+                        highest_score = score
+                        best_match = tidal_album
+                s.set(score=highest_score)
+            if highest_score > self.profile.fuzzy_match_threshold:
                 return {
                     "id": best_match.id,
                     "status": "FUZZY_MATCH" if highest_score < 98 else "EXACT_MATCH",
@@ -80,45 +125,125 @@ class RealTidalClient:
 
     def like_album(self, album_id, artist, album):
         print(f"  > ACTION: 'Liking' album (ID: {album_id}) - '{album}' by '{artist}'")
-        self.session.user.favorites.add_album(album_id)
+        with span("tidal.like_album", "tidal", album_id=str(album_id)):
+            self.session.user.favorites.add_album(album_id)
+        record_favorite(self.library_index, album_id, artist, album)
 
     def add_album_to_playlist(self, album_id, artist, album, playlist_name):
         print(f"  > ACTION: Adding to playlist '{playlist_name}' (ID: {album_id}) - '{album}' by '{artist}'")
-        album_object = self.session.album(album_id)
-        tracks = album_object.tracks()
-        track_ids = [track.id for track in tracks]
+        with span("tidal.album_tracks", "tidal", album_id=str(album_id)) as s:
+            album_object = self.session.album(album_id)
+            tracks = album_object.tracks()
+            track_ids = [track.id for track in tracks]
+            s.set(tracks=len(track_ids))
         
         playlist = self.get_playlist(playlist_name)
         if not playlist:
             print(f"  > Playlist '{playlist_name}' not found. Creating it...")
             new_pl = self.session.user.create_playlist(playlist_name, "Created by my AI agent.")
             playlist = new_pl
+            self._playlists[playlist_name] = playlist
+            remember_playlist(self.library_index, playlist_name, playlist.id)
 
-        playlist.add(track_ids)
+        with span("tidal.playlist_write", "tidal", playlist=playlist_name, tracks=len(track_ids)):
+            playlist.add(track_ids)
+        record_playlist_album(self.library_index, playlist_name, album_id, track_ids, artist, album)
         print(f"  > Successfully added {len(track_ids)} tracks to '{playlist_name}'.")
 
-# --- Helper for Log Management ---
-def load_processed_albums():
-    try:
-        with open(PROCESSED_LOG_PATH, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+    def refresh_library_snapshot(self, playlist_name):
+        """Brings the local favorites/playlist snapshot up to date with paged, incremental fetches."""
+        with span("tidal.snapshot_refresh", "tidal") as s:
+            favorite_pages = refresh_favorites(self.session, self.library_index)
+            playlist = self.get_playlist(playlist_name)
+            playlist_pages = refresh_playlist(self.library_index, playlist) if playlist else 0
+            s.set(pages=favorite_pages + playlist_pages)
+        print(f"  > Library snapshot: {len(self.library_index['favorites'])} favorite albums, "
+              f"{len(self.library_index['playlist_albums'].get(playlist_name, {}))} albums in '{playlist_name}' "
+              f"({favorite_pages + playlist_pages} pages fetched).")
+
+    def already_in_library(self, album_id, decision):
+        """True if the action would be a no-op: album already liked, or already in (or liked instead of) the playlist."""
+        if is_favorite(self.library_index, album_id):
+            return True
+        return decision == "ADD_TO_PLAYLIST" and in_playlist(self.library_index, self.profile.playlist_name, album_id)
+
+# --- Lookup Prefetch (runs during analysis) ---
+class AlbumPrefetcher:
+    """
+    Consumer for analyze_albums(on_album=...): searches Tidal for each playlist candidate on a
+    background thread as soon as Gemini streams it, so the lookups overlap the analysis stage's
+    rate-limit waits and the Tidal stage finds them already in the client's match cache.
+    Likes are capped by score over the whole run, so they are still searched in the Tidal stage.
+    The thread first brings the library snapshot up to date (the Tidal stage's own refresh is then
+    incremental), so albums already liked or in the playlist aren't searched; a profile's first
+    run starts with an empty index.
+    lock (the daemon's tidal_lock) is held per Tidal call only, so HITL commands slot in between.
+    """
+    def __init__(self, tidal_client, lock=None):
+        self.client = tidal_client
+        self.lock = lock
+        # Albums the Tidal stage will skip without searching
+        self.skip_keys = {f"{item['artist']}::{item['album']}" for item in tidal_client.history}
+        self.queued = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, album):
+        if album.get('decision') != 'ADD_TO_PLAYLIST':
+            return
+        unique_key = f"{album.get('artist')}::{album.get('album')}"
+        if unique_key in self.skip_keys:
+            return
+        self.skip_keys.add(unique_key)
+        self.queue.put((album['artist'], album['album']))
 
-def save_processed_album(album_data):
-    processed_albums = load_processed_albums()
+    def _run(self):
+        playlist_name = self.client.profile.playlist_name
+        try:
+            with self.lock or contextlib.nullcontext():
+                self.client.refresh_library_snapshot(playlist_name)
+        except Exception as e:
+            print(f"  > Library snapshot refresh failed before lookups ({e}); using the saved index.")
+        favorite_keys, playlist_keys = library_album_keys(self.client.library_index, playlist_name)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if album_key(*item) in favorite_keys or album_key(*item) in playlist_keys:
+                continue
+            self.queued += 1
+            with self.lock or contextlib.nullcontext():
+                self.client.find_album_id(*item)
+
+    def close(self):
+        """Waits for the queued lookups to finish."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.queued:
+            print(f"  > Looked up {self.queued} playlist candidates on Tidal while analysis was running.")
+
+# --- Helper for Log Management ---
+def record_processed_album(album_data, processed_albums, processed_keys):
+    """Appends the decision to the in-memory history (once per key); take_tidal_actions saves it at the end."""
     unique_key = f"{album_data['artist']}::{album_data['album']}"
-    if not any(item['key'] == unique_key for item in processed_albums):
+    if unique_key not in processed_keys:
+        processed_keys.add(unique_key)
         processed_albums.append({
             "key": unique_key,
             "artist": album_data['artist'],
             "album": album_data['album'],
             "timestamp": time.time(),
-            "action": album_data.get('decision')
+            "action": album_data.get('decision'),
+            "album_id": album_data.get('album_id'),
+            "source_name": album_data.get('source_name')
         })
-        with open(PROCESSED_LOG_PATH, 'w') as f:
-            json.dump(processed_albums, f, indent=2)
-    
+
+def record_source_match(source_stats, album_data, status):
+    """Credits a Tidal match (or miss) to the source the album came from, for the harvest scheduler."""
+    if album_data.get('source_name') and status != "ERROR":
+        record_tidal_result(source_stats, album_data['source_name'], status != "NOT_FOUND")
+
 # --- process_album_action ---
 def process_album_action(tidal_client, album_data):
     artist = album_data.get('artist', 'Unknown')
@@ -140,13 +265,17 @@ def process_album_action(tidal_client, album_data):
     album_id = match_info["id"]
     found_title = match_info["title"]
     match_status = match_info["status"]
+    album_data['album_id'] = str(album_id)  # kept in history so reconcile_agent can match by id
+
+    if tidal_client.already_in_library(album_id, decision):
+        return ("SKIPPED_IN_LIBRARY", artist, album_to_find, found_title, ai_score, "Skipped: Already in your Tidal favorites or playlist.")
     
     try:
         if decision == "LIKE_IMMEDIATELY":
             tidal_client.like_album(album_id, artist, found_title)
             return ("LIKED_" + match_status, artist, album_to_find, found_title, ai_score, reasoning)
         elif decision == "ADD_TO_PLAYLIST":
-            tidal_client.add_album_to_playlist(album_id, artist, found_title, playlist_name=PLAYLIST_NAME)
+            tidal_client.add_album_to_playlist(album_id, artist, found_title, playlist_name=tidal_client.profile.playlist_name)
             return ("ADDED_" + match_status, artist, album_to_find, found_title, album_data['relevance_score'], reasoning)
     except Exception as e:
         print(f"  > Error during Tidal action: {e}")
@@ -156,7 +285,7 @@ def process_album_action(tidal_client, album_data):
 
 
 # --- generate_html_report ---
-def generate_html_report(actions_list, processed_log_len, manual_review_list):
+def generate_html_report(actions_list, processed_log_len, manual_review_list, profile):
     print(f"  > Generating HTML report...")
 
     try:
@@ -196,15 +325,70 @@ def generate_html_report(actions_list, processed_log_len, manual_review_list):
     added_fuzzy = [format_li(*a) for a in actions_list if a[0] == "ADDED_FUZZY_MATCH"]
     not_found = [format_li(*a) for a in actions_list if a[0] == "NOT_FOUND"]
     errors = [format_li(*a) for a in actions_list if a[0] == "ERROR"]
-    skipped_dupe = [format_li(*a) for a in actions_list if a[0].startswith("SKIPPED_PROCESSED")]
+    skipped_dupe = [format_li(*a) for a in actions_list if a[0] in ("SKIPPED_PROCESSED", "SKIPPED_IN_LIBRARY")]
 
     review_html = "".join([format_review_li(a) for a in manual_review_list])
 
     harvester_errors = [l for l in harvester_log if l['status'] == 'error']
     harvester_success = [l for l in harvester_log if l['status'] == 'success']
+    harvester_skipped = [l for l in harvester_log if l['status'] == 'skipped']
+
+    usage_run = latest_run("analysis", profile.usage_path)
+    usage_section = ""
+    if usage_run:
+        usage_rows = sorted(usage_run['sources'].items(), key=lambda kv: kv[1]['input_tokens'] + kv[1]['output_tokens'], reverse=True)
+        usage_html = ''.join([
+            f"<tr><td>{name}</td><td>{u['requests']}</td><td>{u['input_tokens']:,}</td><td>{u['output_tokens']:,}</td><td>{u['albums']}</td>"
+            f"<td>{(u['input_tokens'] + u['output_tokens']) // u['albums'] if u['albums'] else '—'}</td><td>${estimate_cost(u['input_tokens'], u['output_tokens']):.4f}</td></tr>"
+            for name, u in usage_rows
+        ])
+        deferred_html = ''.join([f"<li><b>{d['source']}</b><br><span class='fuzzy'>&nbsp;&nbsp;↳ {d['reason']}</span></li>" for d in usage_run['deferred']])
+        budget = usage_run['budget']
+        usage_section = f"""
+        <h2>💸 LLM Cost Breakdown ({usage_run['requests']} calls, {usage_run.get('failed_requests', 0)} failed, ~${usage_run['estimated_cost_usd']:.4f})</h2>
+        <p>Input tokens: {usage_run['input_tokens']:,} | Output tokens: {usage_run['output_tokens']:,} | Budget: {budget['max_tokens'] or 'unlimited'} tokens, {budget['max_requests'] or 'unlimited'} requests.</p>
+        <table>
+            <tr><th>Source</th><th>Calls</th><th>Input tok</th><th>Output tok</th><th>Albums</th><th>Tok / album</th><th>Est. cost</th></tr>
+            {usage_html}
+        </table>
+        <h2 class="not-found">⏳ Deferred by Budget ({len(usage_run['deferred'])})</h2>
+        <p>These pages were skipped this run because the LLM budget ran out (lowest expected yield first, see <code>source_stats.json</code>).</p>
+        <ul>
+            {deferred_html or "<li>None</li>"}
+        </ul>
+    """
+
+    gate_run = latest_gate_run(profile.model_path)
+    gate_section = ""
+    if gate_run:
+        judged = gate_run['agree'] + gate_run['disagree']
+        gate_section = f"""
+        <h2>🧠 Local Relevance Filter ({gate_run.get('mode', 'learning')})</h2>
+        <p>A small model trained on your history and Gemini's past answers scores each page chunk first; once shadow runs show it would skip enough chunks without missing albums, only chunks it can't rule out go to Gemini. Model: <code>relevance_model.json</code> ({gate_run['trained_examples']:,} examples).</p>
+        <table>
+            <tr><th>Pages skipped</th><th>Chunks skipped</th><th>Chars not sent</th><th>Agreement with Gemini</th><th>Would-skip chunks with albums</th></tr>
+            <tr><td>{gate_run['pages_skipped']} / {gate_run['pages']}</td><td>{gate_run['chunks_skipped']} / {gate_run['chunks']}</td><td>{gate_run['chars_skipped']:,}</td>
+            <td>{f"{gate_run['agreement']:.1%} of {judged}" if judged else '—'}</td><td>{gate_run.get('would_skip_misses', 0)} / {gate_run.get('would_skip_checked', 0)} (would skip {gate_run.get('would_skip', 0)})</td></tr>
+        </table>
+        <p class="reasoning">Confusion vs Gemini (model → Gemini): relevant→found {gate_run['true_pos']}, relevant→none {gate_run['false_pos']}, irrelevant→none {gate_run['true_neg']}, irrelevant→found {gate_run['false_neg']}.</p>
+    """
+
+    breaker_order = {"open": 0, "half_open": 1, "closed": 2}
+    breaker_rows = sorted(load_source_stats()['sources'].items(), key=lambda kv: (breaker_order.get(kv[1].get('breaker', 'closed'), 2), kv[0]))
+    def format_latency(entry):
+        latency = latency_summary(entry)
+        return f"{latency['p50_ms']} / {latency['p95_ms']} ms" if latency else "—"
+
+    breaker_html = ''.join([
+        f"<tr><td>{name}</td><td>{e.get('breaker', 'closed').replace('_', '-')}</td><td>{e.get('consecutive_failures', 0)}</td>"
+        f"<td>{fetch_timeout(e)[1]}s</td><td>{format_latency(e)}</td></tr>"
+        for name, e in breaker_rows
+    ])
+    breakers_open = sum(1 for _, e in breaker_rows if e.get('breaker') == "open")
 
     harvester_error_html = ''.join([f"<li><b>{h['source']}</b><br><span class='fuzzy'>&nbsp;&nbsp;↳ {h['message']}</span></li>" for h in harvester_errors])
     harvester_success_html = ''.join([f"<li><b>{h['source']}</b><br>&nbsp;&nbsp;↳ {h['message']}</li>" for h in harvester_success])
+    harvester_skipped_html = ''.join([f"<li><b>{h['source']}</b><br><span class='reasoning'>&nbsp;&nbsp;↳ {h['message']}</span></li>" for h in harvester_skipped])
 
     html = f"""
     <!DOCTYPE html>
@@ -229,6 +413,9 @@ def generate_html_report(actions_list, processed_log_len, manual_review_list):
             .review li {{ background-color: #f0f8ff; border-color: #007bff; }}
             .nav-link {{ display: inline-block; margin-bottom: 10px; padding: 8px 12px; background-color: #e1f5fe; color: #0277bd; text-decoration: none; border-radius: 4px; font-weight: bold; font-size: 0.9em; border: 1px solid #b3e5fc; }}
             .nav-link:hover {{ background-color: #b3e5fc; }}
+            table {{ width: 100%; border-collapse: collapse; background-color: #ffffff; font-size: 0.9em; }}
+            th, td {{ text-align: left; padding: 6px 8px; border: 1px solid #d1d5da; }}
+            th {{ background-color: #eaecef; }}
         </style>
     </head>
     <body>
@@ -240,14 +427,14 @@ def generate_html_report(actions_list, processed_log_len, manual_review_list):
         <p>Last run: {time.ctime()} | Albums tracked in history: {processed_log_len}</p>
 
         <h2>⭐ Albums Liked ({len(liked_exact) + len(liked_fuzzy)})</h2>
-        <p>These are the Top {MAX_LIKED_ALBUMS_PER_RUN} albums with the highest AI scores (90-100).</p>
+        <p>These are the Top {profile.max_liked_albums_per_run} albums with the highest AI scores (90-100).</p>
         <ul>
             { "".join(liked_exact)}
             { "".join(liked_fuzzy)}
             {'<li>None</li>' if not (liked_exact or liked_fuzzy) else ''}
         </ul>
 
-        <h2>🎶 Added to '{PLAYLIST_NAME}' ({len(added_exact) + len(added_fuzzy)})</h2>
+        <h2>🎶 Added to '{profile.playlist_name}' ({len(added_exact) + len(added_fuzzy)})</h2>
         <p>These albums scored 80-89 and were added to your playlist.</p>
         <ul>
             { "".join(added_exact)}
@@ -285,106 +472,184 @@ def generate_html_report(actions_list, processed_log_len, manual_review_list):
             {harvester_error_html or "<li>None</li>"}
         </ul>
 
+        <h2>🔌 Source Circuit Breakers ({breakers_open} open)</h2>
+        <p>A source opens its breaker after repeated failed fetches and is skipped until a half-open probe succeeds. Timeouts adapt to each source's recent latency.</p>
+        <table>
+            <tr><th>Source</th><th>Breaker</th><th>Failures in a row</th><th>Next timeout</th><th>Latency p50 / p95</th></tr>
+            {breaker_html or "<tr><td colspan='5'>No fetch history yet.</td></tr>"}
+        </table>
+
+        <h2 class="skipped">⏭️ Sources Skipped by Scheduler ({len(harvester_skipped)})</h2>
+        <p>Open circuit breaker, low historical yield (approved albums per call, Tidal match rate, fetch failures) or outside this run's LLM budget. Low-yield sources are re-probed periodically.</p>
+        <ul class="skipped">
+            {harvester_skipped_html or "<li>None</li>"}
+        </ul>
+
         <h2 class="skipped">🚫 Skipped Duplicates ({len(skipped_dupe)})</h2>
-        <p>These albums were successfully filtered against the permanent history file (<code>processed_albums.json</code>).</p>
+        <p>These albums were successfully filtered against the permanent history file (<code>processed_albums.json</code>) or the Tidal library snapshot (<code>library_index.json</code>).</p>
         <ul>
             { "".join(skipped_dupe) or "<li>None</li>"}
         </ul>
+        {usage_section}
+        {gate_section}
+        {TRACE_PLACEHOLDER}
     </body>
     </html>
     """
     
     try:
-        with open(REPORT_FILE_PATH, 'w') as f:
+        with open(profile.report_path, 'w') as f:
             f.write(html)
-        print(f"  > Successfully wrote HTML report to {REPORT_FILE_PATH}")
+        print(f"  > Successfully wrote HTML report to {profile.report_path}")
     except Exception as e:
         print(f"  > Error writing HTML report: {e}")
 
 
+def add_trace_summary(profile=None):
+    """Adds the run's span summary to the report. Call after the last stage span has closed (i.e. next to export_trace())."""
+    profile = profile or Profile()
+    trace_rows = tracing.summarize() if tracing.is_enabled() else []
+    if not trace_rows:
+        return
+    try:
+        with open(profile.report_path, 'r') as f:
+            html = f.read()
+    except FileNotFoundError:
+        return
+    trace_html = ''.join([
+        f"<tr><td>{r['name']}</td><td>{r['count']}</td><td>{r['total_ms']:.0f}</td><td>{r['mean_ms']:.1f}</td><td>{r['max_ms']:.1f}</td>"
+        f"<td>{', '.join(f'{k}: {v:,.0f}' for k, v in r['totals'].items())}</td></tr>"
+        for r in trace_rows
+    ])
+    trace_section = f"""
+        <h2>⏱️ Run Trace Summary ({len(trace_rows)} span types)</h2>
+        <p>Where this run spent its time. Full trace: <code>{tracing.TRACE_FILE_PATH}</code> (open in ui.perfetto.dev or chrome://tracing; in CI it is attached to the workflow run as an artifact).</p>
+        <table>
+            <tr><th>Span</th><th>Count</th><th>Total ms</th><th>Mean ms</th><th>Max ms</th><th>Totals</th></tr>
+            {trace_html}
+        </table>
+    """
+    with open(profile.report_path, 'w') as f:
+        f.write(html.replace(TRACE_PLACEHOLDER, trace_section, 1))
+
 # --- Main Function ---
-def take_tidal_actions():
+def take_tidal_actions(tidal_client=None, profile=None):
+    """Acts on the profile's analysis hand-off. A passed-in client brings its own profile."""
     print("TidalActionAgent: Starting run...")
     
+    if tidal_client is None:
+        try:
+            tidal_client = RealTidalClient(profile=profile)
+        except Exception as e:
+            print(f"Could not start Tidal agent. Exiting. Error: {e}")
+            return 
+    profile = tidal_client.profile
+    history, history_path = tidal_client.history, profile.processed_log_path
+
     # --- Load Processed Log ---
-    processed_albums_keys = {f"{item['artist']}::{item['album']}" for item in load_processed_albums()}
-    
-    try:
-        tidal_client = RealTidalClient()
-    except Exception as e:
-        print(f"Could not start Tidal agent. Exiting. Error: {e}")
-        return 
+    processed_albums_keys = {f"{item['artist']}::{item['album']}" for item in history}
 
     try:
-        with open(INPUT_FILE_PATH, 'r') as f:
-            filtered_albums = json.load(f)
+        filtered_albums = read_handoff(profile.filtered_list_path)
         print(f"Found {len(filtered_albums)} approved albums to process.")
     except (FileNotFoundError, json.JSONDecodeError):
         print(f"Note: Filtered albums file not found or empty. No albums processed.")
         filtered_albums = []
         
-    # --- Anti-Duplication Filter ---
-    albums_to_process = []
-    albums_skipped = []
-
-    for album in filtered_albums:
-        unique_key = f"{album.get('artist')}::{album.get('album')}"
-        if unique_key in processed_albums_keys:
-            # FIX: Pass an empty string "" instead of "N/A" for the found_title to force format_li to use the original album title.
-            album_data_tuple = ("SKIPPED_PROCESSED", album.get('artist'), album.get('album'), "", album.get('relevance_score'), "Skipped: Already processed in a previous run.")
-            albums_skipped.append(album_data_tuple)
-        else:
-            albums_to_process.append(album)
+    recorded_keys = set(processed_albums_keys)  # grows with this run's decisions
+    history_len = len(history)
+    try:
+        # --- Anti-Duplication Filter ---
+        # History first, then the Tidal library snapshot (albums liked by hand or already in the playlist)
+        tidal_client.refresh_library_snapshot(profile.playlist_name)
+        favorite_keys, playlist_keys = library_album_keys(tidal_client.library_index, profile.playlist_name)
+        albums_to_process = []
+        albums_skipped = []
+
+        for album in filtered_albums:
+            unique_key = f"{album.get('artist')}::{album.get('album')}"
+            library_key = album_key(album.get('artist'), album.get('album'))
+            if unique_key in processed_albums_keys:
+                # FIX: Pass an empty string "" instead of "N/A" for the found_title to force format_li to use the original album title.
+                album_data_tuple = ("SKIPPED_PROCESSED", album.get('artist'), album.get('album'), "", album.get('relevance_score'), "Skipped: Already processed in a previous run.")
+                albums_skipped.append(album_data_tuple)
+            elif library_key in favorite_keys or (album.get('decision') == 'ADD_TO_PLAYLIST' and library_key in playlist_keys):
+                album_data_tuple = ("SKIPPED_IN_LIBRARY", album.get('artist'), album.get('album'), "", album.get('relevance_score'), "Skipped: Already in your Tidal favorites or playlist.")
+                albums_skipped.append(album_data_tuple)
+                record_processed_album(dict(album, decision="ALREADY_IN_LIBRARY"), history, recorded_keys)
+            else:
+                albums_to_process.append(album)
             
-    if albums_skipped:
-        print(f"  > Skipped {len(albums_skipped)} albums already found in history.")
+        if albums_skipped:
+            print(f"  > Skipped {len(albums_skipped)} albums already found in history or your Tidal library.")
 
-    # --- Separate lists ---
-    albums_to_like_raw = [a for a in albums_to_process if a.get('decision') == 'LIKE_IMMEDIATELY']
-    albums_to_playlist = [a for a in albums_to_process if a.get('decision') == 'ADD_TO_PLAYLIST']
-    albums_to_review = [a for a in albums_to_process if a.get('decision') == 'REVIEW_MANUALLY']
+        # --- Separate lists ---
+        albums_to_like_raw = [a for a in albums_to_process if a.get('decision') == 'LIKE_IMMEDIATELY']
+        albums_to_playlist = [a for a in albums_to_process if a.get('decision') == 'ADD_TO_PLAYLIST']
+        albums_to_review = [a for a in albums_to_process if a.get('decision') == 'REVIEW_MANUALLY']
     
-    # Sort
-    albums_to_like_raw.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
-    albums_to_playlist.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
-    albums_to_review.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+        # Sort
+        albums_to_like_raw.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+        albums_to_playlist.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+        albums_to_review.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
     
-    # Apply the capping rule
-    albums_to_like = albums_to_like_raw[:MAX_LIKED_ALBUMS_PER_RUN]
+        # Apply the capping rule
+        albums_to_like = albums_to_like_raw[:profile.max_liked_albums_per_run]
     
-    print(f"  > Found {len(albums_to_like)} albums to 'Like', {len(albums_to_playlist)} to 'Add to Playlist', and {len(albums_to_review)} to 'Review Manually'.")
-
-    actions_list_for_report = [] 
-    actions_list_for_report.extend(albums_skipped) # Add skipped list to report
-
-    # --- Process Actions ---
-    print(f"\n--- Processing {len(albums_to_like)} 'Like' Actions ---")
-    for album_data in albums_to_like:
-        action_result_tuple = process_album_action(tidal_client, album_data)
-        actions_list_for_report.append(action_result_tuple)
-        # Log successful action
-        if action_result_tuple[0].startswith("LIKED"):
-            save_processed_album(album_data)
-
-    print(f"\n--- Processing {len(albums_to_playlist)} 'Playlist' Actions ---")
-    for album_data in albums_to_playlist:
-        action_result_tuple = process_album_action(tidal_client, album_data)
-        actions_list_for_report.append(action_result_tuple)
-        # Log successful action
-        if action_result_tuple[0].startswith("ADDED"):
-            save_processed_album(album_data)
+        print(f"  > Found {len(albums_to_like)} albums to 'Like', {len(albums_to_playlist)} to 'Add to Playlist', and {len(albums_to_review)} to 'Review Manually'.")
+
+        actions_list_for_report = [] 
+        actions_list_for_report.extend(albums_skipped) # Add skipped list to report
+
+        source_stats = load_source_stats(profile.stats_path)
+        relevance_model = load_model(profile.model_path)
+
+        # --- Process Actions ---
+        print(f"\n--- Processing {len(albums_to_like)} 'Like' Actions ---")
+        for album_data in albums_to_like:
+            action_result_tuple = process_album_action(tidal_client, album_data)
+            actions_list_for_report.append(action_result_tuple)
+            record_source_match(source_stats, album_data, action_result_tuple[0])
+            # Log successful action
+            if action_result_tuple[0].startswith("LIKED"):
+                record_processed_album(album_data, history, recorded_keys)
+                record_feedback(relevance_model, album_data.get('album_id'), "LIKE_IMMEDIATELY", album_data)
+            elif action_result_tuple[0] == "SKIPPED_IN_LIBRARY":
+                record_processed_album(dict(album_data, decision="ALREADY_IN_LIBRARY"), history, recorded_keys)
+
+        print(f"\n--- Processing {len(albums_to_playlist)} 'Playlist' Actions ---")
+        for album_data in albums_to_playlist:
+            action_result_tuple = process_album_action(tidal_client, album_data)
+            actions_list_for_report.append(action_result_tuple)
+            record_source_match(source_stats, album_data, action_result_tuple[0])
+            # Log successful action
+            if action_result_tuple[0].startswith("ADDED"):
+                record_processed_album(album_data, history, recorded_keys)
+                # Labeled later, when a cleanup command keeps or removes it
+                remember_candidate(relevance_model, album_data.get('album_id'), album_data)
+            elif action_result_tuple[0] == "SKIPPED_IN_LIBRARY":
+                record_processed_album(dict(album_data, decision="ALREADY_IN_LIBRARY"), history, recorded_keys)
     
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    with open(LOG_FILE_PATH, 'a') as f:
+        save_source_stats(source_stats, profile.stats_path)
+        save_library_index(tidal_client.library_index, profile.library_index_path)
+        save_model(relevance_model, profile.model_path)
+    finally:
+        # One history write per run, also when a later album fails: its predecessors were already acted on in Tidal
+        if len(history) != history_len:
+            save_history(history, history_path)
+        tidal_client.reset_match_cache()  # a long-lived client searches afresh next run, even after a failed one
+
+    os.makedirs(profile.data_dir, exist_ok=True)
+    with open(profile.run_log_path, 'a') as f:
         f.write(f"\n--- TidalAgent Run: {time.ctime()} ---\n")
         for status, artist, original, found, score, reasoning in actions_list_for_report:
             f.write(f"[{status}] (Score: {score}) | Artist: '{artist}' | Looking for: '{original}' | Found: '{found}' | Reason: {reasoning}\n")
     
     # REMOVED the call to fetch current playlist items to speed up execution and because management is done via app.
-    generate_html_report(actions_list_for_report, len(load_processed_albums()), albums_to_review)
+    generate_html_report(actions_list_for_report, len(history), albums_to_review, profile)
     
     print(f"\nTidalActionAgent: Run complete. Processed {len(actions_list_for_report)} total actions.")
-    print(f"Actions logged to {LOG_FILE_PATH} and {REPORT_FILE_PATH}")
+    print(f"Actions logged to {profile.run_log_path} and {profile.report_path}")
 
 if __name__ == "__main__":
     take_tidal_actions()
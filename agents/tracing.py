@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+
+# --- Configuration ---
+TRACE_FILE_PATH = 'data/trace.json'
+TRACE_ENV_VAR = 'MUSIC_AGENT_TRACE'
+OUTPUT_DIR = 'data'
+# Span attributes that are meaningful to sum across a run (scores, statuses and ids are not)
+SUMMED_ATTRS = ('bytes', 'chars', 'output_chars', 'input_tokens', 'output_tokens', 'tracks', 'albums', 'pages', 'entries', 'seconds', 'results')
+
+# --- Tracer State ---
+_enabled = os.getenv(TRACE_ENV_VAR, '').lower() in ('1', 'true', 'yes')
+_events = []
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+class _Span:
+    """A timed section of work. Recorded as a Chrome trace 'complete' event on exit."""
+    __slots__ = ('name', 'category', 'attrs', 'start')
+
+    def __init__(self, name, category, attrs):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.start = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = f"{exc_type.__name__}: {exc}"
+        event = {
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": round((self.start - _origin) * 1e6, 1),
+            "dur": round((end - self.start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.attrs,
+        }
+        with _lock:
+            _events.append(event)
+        return False
+
+class _NoopSpan:
+    """Returned while tracing is disabled, so instrumented code pays for one call and nothing else."""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+# --- Public API ---
+def span(name, category='agent', **attrs):
+    """
+    Usage:
+        with span("harvest.fetch", "http", url=url) as s:
+            ...
+            s.set(bytes=len(body))
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(name, category, attrs)
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _events.clear()
+
+def events():
+    with _lock:
+        return list(_events)
+
+def merge(other_events):
+    """Adds spans recorded in another process (a profile worker) to this run's trace; their pid keeps them apart."""
+    with _lock:
+        _events.extend(other_events)
+
+def summarize():
+    """
+    Aggregates recorded spans by name, summing the SUMMED_ATTRS attributes.
+    Returns a list of dicts sorted by total time, slowest first.
+    """
+    with _lock:
+        events = list(_events)
+    summary = {}
+    for e in events:
+        row = summary.setdefault(e['name'], {"name": e['name'], "category": e['cat'], "count": 0, "total_ms": 0.0, "max_ms": 0.0, "totals": {}})
+        dur_ms = e['dur'] / 1000
+        row['count'] += 1
+        row['total_ms'] += dur_ms
+        row['max_ms'] = max(row['max_ms'], dur_ms)
+        for key in SUMMED_ATTRS:
+            value = e['args'].get(key)
+            if isinstance(value, (int, float)):
+                row['totals'][key] = row['totals'].get(key, 0) + value
+    rows = sorted(summary.values(), key=lambda r: r['total_ms'], reverse=True)
+    for row in rows:
+        row['total_ms'] = round(row['total_ms'], 2)
+        row['max_ms'] = round(row['max_ms'], 2)
+        row['mean_ms'] = round(row['total_ms'] / row['count'], 2)
+    return rows
+
+def export_trace(path=TRACE_FILE_PATH):
+    """Writes the spans in Chrome Trace Event format (chrome://tracing, ui.perfetto.dev)."""
+    if not _enabled:
+        return None
+    with _lock:
+        events = list(_events)
+    os.makedirs(os.path.dirname(path) or OUTPUT_DIR, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    print(f"Trace with {len(events)} spans saved to {path}")
+    return path
@@ -0,0 +1,289 @@
+import json
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Shared Call Counters ---
+class CallCounter:
+    """Counts calls and bytes per (service, operation) for one benchmark stage."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.bytes = Counter()
+
+    def record(self, name, nbytes=0):
+        with self._lock:
+            self.calls[name] += 1
+            self.bytes[name] += nbytes
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.bytes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.calls), dict(self.bytes)
+
+COUNTER = CallCounter()
+
+# --- Local HTTP Server (recorded source pages) ---
+class _PageHandler(BaseHTTPRequestHandler):
+    pages = {}
+
+    def do_GET(self):
+        body = self.pages.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            COUNTER.record("http.get", 0)
+            return
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        COUNTER.record("http.get", len(payload))
+
+    def log_message(self, format, *args):
+        pass
+
+def start_page_server(pages):
+    """Serves {path: html} on an ephemeral localhost port. Returns (server, base_url)."""
+    handler = type('PageHandler', (_PageHandler,), {'pages': pages})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def page_marker(index):
+    return f"bench-page-{index}"
+
+def render_page(index, page_text):
+    return f"<html><head><title>{page_marker(index)}</title></head><body><p>{page_marker(index)}</p><p>{page_text}</p></body></html>"
+
+# --- Stub LLM (stands in for google.generativeai.GenerativeModel) ---
+class _UsageMetadata:
+    def __init__(self, prompt_chars, output_chars):
+        self.prompt_token_count = prompt_chars // 4
+        self.candidates_token_count = output_chars // 4
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+class _StubResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+class StubGenerativeModel:
+    """
+    Deterministic replacement for genai.GenerativeModel.
+    Album pages get the albums assigned to their page index; the discovery
+    prompt gets its own source list echoed back with one swap.
+    """
+    albums_by_page = {}
+    discovery_extra_source = None
+
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction or ""
+
+    def _answer(self, contents):
+        if contents.startswith("Here is my current list of sources"):
+            sources = json.loads(contents.split("\n\n", 1)[1])
+            if sources:
+                sources = sources[:-1]
+            if self.discovery_extra_source:
+                sources.append(self.discovery_extra_source)
+            return json.dumps(sources, indent=2)
+        match = re.search(r"bench-page-(\d+)", contents)
+        albums = self.albums_by_page.get(int(match.group(1)), []) if match else []
+        return "```json\n" + json.dumps(albums, indent=2) + "\n```"
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        text = self._answer(contents)
+        COUNTER.record("llm.generate_content", len(contents) + len(text))
+        usage = _UsageMetadata(len(self.system_instruction) + len(contents), len(text))
+        if not stream:
+            return _StubResponse(text, usage)
+        # Streamed responses arrive as a handful of text chunks; usage rides on the last one.
+        size = max(1, len(text) // 4)
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        return [_StubResponse(c, usage if i == len(chunks) - 1 else None) for i, c in enumerate(chunks)]
+
+# --- Fake tidalapi Session ---
+class _Named:
+    def __init__(self, name):
+        self.name = name
+
+def _now():
+    return datetime.now(timezone.utc)
+
+class FakeTrack:
+    def __init__(self, track_id, album):
+        self.id = track_id
+        self.album = album
+        self.name = f"Track {track_id}"
+        self.user_date_added = None
+
+class FakeAlbum:
+    def __init__(self, album_id, artist, name, track_count=8):
+        self.id = album_id
+        self.artist = _Named(artist)
+        self.name = name
+        self.user_date_added = None
+        self._tracks = [FakeTrack(album_id * 100 + n, self) for n in range(track_count)]
+
+    def tracks(self, limit=None, offset=0):
+        COUNTER.record("tidal.album.tracks")
+        return list(self._tracks)
+
+class FakePlaylist:
+    def __init__(self, playlist_id, name, description=""):
+        self.id = playlist_id
+        self.name = name
+        self.description = description
+        self._items = []
+        self.last_updated = _now()
+        self.last_item_added_at = None
+
+    @property
+    def num_tracks(self):
+        return len(self._items)
+
+    def _touch(self, added=False):
+        self.last_updated = _now()
+        if added:
+            self.last_item_added_at = self.last_updated
+
+    def seed(self, tracks):
+        """Pre-existing playlist content (no API call)."""
+        for track in tracks:
+            track.user_date_added = _now()
+            self._items.append(track)
+        self._touch(added=True)
+
+    def tracks(self, limit=None, offset=0, order=None, order_direction=None):
+        COUNTER.record("tidal.playlist.tracks")
+        items = self._items
+        if order is not None and getattr(order, 'value', order) == 'DATE':
+            items = sorted(items, key=lambda t: t.user_date_added or _now(), reverse=getattr(order_direction, 'value', '') == 'DESC')
+        end = None if limit is None else offset + limit
+        return list(items[offset:end])
+
+    def add(self, media_ids, allow_duplicates=False, position=-1, limit=100):
+        COUNTER.record("tidal.playlist.add")
+        existing = {t.id for t in self._items}
+        added = []
+        for media_id in media_ids:
+            if not allow_duplicates and media_id in existing:
+                continue
+            track = FAKE_CATALOG.tracks[int(media_id)]
+            track.user_date_added = _now()
+            self._items.append(track)
+            added.append(len(self._items) - 1)
+        self._touch(added=True)
+        return added
+
+    def remove_by_id(self, media_id):
+        # Mirrors tidalapi: every single-id removal re-reads the whole playlist.
+        COUNTER.record("tidal.playlist.remove_by_id")
+        ids = [str(t.id) for t in self.tracks()]
+        if str(media_id) not in ids:
+            return False
+        del self._items[ids.index(str(media_id))]
+        self._touch()
+        return True
+
+    def delete_by_id(self, media_ids):
+        COUNTER.record("tidal.playlist.delete_by_id")
+        wanted = {str(m) for m in media_ids}
+        self.tracks()
+        self._items = [t for t in self._items if str(t.id) not in wanted]
+        self._touch()
+        return True
+
+class FakeFavorites:
+    def __init__(self):
+        self._albums = []
+
+    def add_album(self, album_id):
+        COUNTER.record("tidal.favorites.add_album")
+        ids = album_id if isinstance(album_id, list) else [album_id]
+        for i in ids:
+            album = FAKE_CATALOG.albums[int(i)]
+            if album not in self._albums:
+                album.user_date_added = _now()
+                self._albums.append(album)
+        return True
+
+    def albums(self, limit=50, offset=0, order=None, order_direction=None):
+        COUNTER.record("tidal.favorites.albums")
+        albums = self._albums
+        if getattr(order_direction, 'value', '') == 'DESC':
+            albums = list(reversed(albums))
+        return list(albums[offset:offset + limit])
+
+class FakeUser:
+    def __init__(self):
+        self.username = "benchmark-user"
+        self.favorites = FakeFavorites()
+        self._playlists = []
+
+    def playlists(self):
+        COUNTER.record("tidal.user.playlists")
+        return list(self._playlists)
+
+    def create_playlist(self, name, description=""):
+        COUNTER.record("tidal.user.create_playlist")
+        playlist = FakePlaylist(f"pl-{len(self._playlists) + 1}", name, description)
+        self._playlists.append(playlist)
+        return playlist
+
+class FakeCatalog:
+    """The whole fake Tidal world: albums, tracks, the user and their playlists."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.albums = {}
+        self.tracks = {}
+        self.by_query = {}
+        self.user = FakeUser()
+
+    def add_album(self, artist, name):
+        album = FakeAlbum(len(self.albums) + 1, artist, name)
+        self.albums[album.id] = album
+        for track in album._tracks:
+            self.tracks[track.id] = track
+        self.by_query[f"{artist} {name}".lower()] = album
+        return album
+
+FAKE_CATALOG = FakeCatalog()
+
+class FakeSession:
+    def __init__(self, *args, **kwargs):
+        self.user = None
+
+    def load_oauth_session(self, token_type, access_token, refresh_token=None, expiry_time=None, **kwargs):
+        COUNTER.record("tidal.session.load_oauth_session")
+        self.user = FAKE_CATALOG.user
+        return True
+
+    def search(self, query, models=None, limit=50, offset=0):
+        COUNTER.record("tidal.session.search")
+        album = FAKE_CATALOG.by_query.get(query.lower())
+        return {"albums": [album] if album else []}
+
+    def album(self, album_id):
+        COUNTER.record("tidal.session.album")
+        return FAKE_CATALOG.albums[int(album_id)]
+
+    def playlist(self, playlist_id=None):
+        COUNTER.record("tidal.session.playlist")
+        for pl in FAKE_CATALOG.user._playlists:
+            if pl.id == playlist_id:
+                return pl
+        raise ValueError(f"Playlist {playlist_id} not found")
@@ -0,0 +1,421 @@
+"""
+Offline benchmark suite for the music agent workflow.
+
+Runs every agent stage against local stand-ins, so no network or secrets are needed:
+  * harvest_new_albums()  -> local HTTP server serving the recorded pages in fixtures/
+  * analyze_albums()      -> stub Gemini model (fakes.StubGenerativeModel), rate-limit sleeps skipped
+  * take_tidal_actions()  -> fake tidalapi session (fakes.FakeSession)
+  * process_commands()    -> same fake session, with pre-filled command playlists,
+                             plus one single-album HITL command (stage "hitl") and the same
+                             command sent to the --daemon endpoint (stage "hitl_daemon")
+  * run_discovery()       -> stub Gemini model
+  * reconcile()           -> same fake session, history checked against the library it left behind
+  * run_batch()           -> two profiles (stage "profiles"): one shared harvest, then analysis,
+                             Tidal and cleanup per profile, in-process so every call is counted
+
+Each stage is measured at 1x, 10x and 100x the recorded source/album counts
+(the history file stays at its fixture size). Results are compared against
+benchmarks/baseline.json: more calls, more bytes written to disk or more peak memory
+fail the run; wall time is too noisy to gate on and is only reported as a warning.
+
+Usage:
+  python benchmarks/run_benchmarks.py                   # run and compare
+  python benchmarks/run_benchmarks.py --scales 1,10     # quicker run
+  python benchmarks/run_benchmarks.py --update-baseline # store new baseline
+  python benchmarks/run_benchmarks.py --json results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(REPO_DIR, 'agents'))
+
+import fakes
+
+# --- Configuration ---
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+BASELINE_FILE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_SCALES = [1, 10, 100]
+TIME_TOLERANCE = 0.5       # warn when a stage is >50% slower than baseline...
+TIME_FLOOR_SECONDS = 0.05  # ...and slower by more than this in absolute terms
+WRITE_TOLERANCE = 0.1      # fail when a stage writes >10% more bytes (timestamps vary a little)...
+WRITE_FLOOR_BYTES = 16 * 1024  # ...and more than this in absolute terms
+MEMORY_TOLERANCE = 0.5
+MEMORY_FLOOR_MB = 1.0
+PLAYLIST_SEED_PER_SCALE = 20
+REMOVE_COMMANDS_PER_SCALE = 2
+PROMOTE_COMMANDS_PER_SCALE = 1
+NOT_FOUND_EVERY = 7        # every Nth album is missing from the fake Tidal catalog
+
+FAKE_ENV = {
+    "GOOGLE_API_KEY": "benchmark-key",
+    "TIDAL_TOKEN_TYPE": "Bearer",
+    "TIDAL_ACCESS_TOKEN": "benchmark-access",
+    "TIDAL_REFRESH_TOKEN": "benchmark-refresh",
+    "TIDAL_EXPIRY_TIME": "4102444800",
+    # Unlimited LLM budget, so every scale exercises its full source/album count
+    "LLM_MAX_TOKENS_PER_RUN": "0",
+    "LLM_MAX_REQUESTS_PER_RUN": "0",
+}
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r') as f:
+        return json.load(f)
+
+# --- Workspace Setup ---
+def replica_name(name, replica):
+    return name if replica == 0 else f"{name} (r{replica})"
+
+def build_workspace(scale, base_url_holder):
+    """
+    Creates a temporary working directory laid out like the repo root
+    (config/ + data/) and primes the stub LLM and fake Tidal catalog for `scale`.
+    Returns (workspace_path, pages_by_path).
+    """
+    workspace = tempfile.mkdtemp(prefix=f"music-agent-bench-{scale}x-")
+    os.makedirs(os.path.join(workspace, 'config'))
+    os.makedirs(os.path.join(workspace, 'data'))
+    for prompt in ('analyzer_prompt.txt', 'discovery_prompt.txt'):
+        shutil.copy(os.path.join(REPO_DIR, 'config', prompt), os.path.join(workspace, 'config', prompt))
+
+    recorded_pages = load_fixture('source_pages.json')
+    recorded_albums = load_fixture('albums.json')
+    history = load_fixture('history.json')
+
+    pages = {}
+    sources = []
+    albums_by_page = {}
+    page_count = len(recorded_pages)
+    for replica in range(scale):
+        for offset, recorded in enumerate(recorded_pages):
+            index = replica * page_count + offset
+            path = f"/source/{index}"
+            pages[path] = fakes.render_page(index, recorded['page_text'])
+            sources.append({
+                "category": "Tier I" if offset < page_count // 2 else "Tier II",
+                "website": replica_name(recorded['source_name'], replica),
+                "relevancy_score": round(9.0 - (offset % 10) * 0.3, 1),
+                "genre_focus": "Benchmark",
+                "description": "Recorded page served locally",
+                "url": f"{base_url_holder}{path}",
+            })
+            albums_by_page[index] = []
+
+    fakes.FAKE_CATALOG.reset()
+    album_counter = 0
+    for replica in range(scale):
+        for offset, album in enumerate(recorded_albums):
+            page_index = replica * page_count + (offset % page_count)
+            entry = dict(album, artist=replica_name(album['artist'], replica))
+            albums_by_page[page_index].append(entry)
+            album_counter += 1
+            if album_counter % NOT_FOUND_EVERY:
+                fakes.FAKE_CATALOG.add_album(entry['artist'], entry['album'])
+
+    fakes.StubGenerativeModel.albums_by_page = albums_by_page
+    fakes.StubGenerativeModel.discovery_extra_source = {
+        "Source_Name": "Benchmark New Source",
+        "URL": f"{base_url_holder}/source/0",
+        "Tier": "Tier II",
+        "Primary_Genre_Focus": "Benchmark",
+        "Key_Critical_Strength": "Stub suggestion",
+        "Relevancy_Score": 6.0,
+    }
+
+    # Seed the user's Tidal state: a discovery playlist of previously added albums
+    # and command playlists pointing at some of them.
+    user = fakes.FAKE_CATALOG.user
+    discovery = user.create_playlist("AI Music Discovery")
+    remove_pl = user.create_playlist("[Agent] Remove")
+    promote_pl = user.create_playlist("[Agent] Promote")
+    playlist_history = [h for h in history if h['action'] == 'ADD_TO_PLAYLIST']
+    seeded = []
+    for replica in range(scale):
+        for h in playlist_history[:PLAYLIST_SEED_PER_SCALE]:
+            seeded.append(fakes.FAKE_CATALOG.add_album(replica_name(h['artist'], replica), h['album']))
+    discovery.seed([t for album in seeded for t in album._tracks])
+    remove_count = REMOVE_COMMANDS_PER_SCALE * scale
+    promote_count = PROMOTE_COMMANDS_PER_SCALE * scale
+    remove_pl.seed([a._tracks[0] for a in seeded[:remove_count]])
+    promote_pl.seed([a._tracks[0] for a in seeded[remove_count:remove_count + promote_count]])
+    fakes.COUNTER.reset()
+
+    with open(os.path.join(workspace, 'config', 'sources.json'), 'w') as f:
+        json.dump({"sources": sources}, f, indent=2)
+    with open(os.path.join(workspace, 'data', 'processed_albums.json'), 'w') as f:
+        json.dump(history, f, indent=2)
+
+    return workspace, pages
+
+def data_bytes(workspace):
+    total = 0
+    for root, _, files in os.walk(os.path.join(workspace, 'data')):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def bytes_written():
+    """Bytes this process has passed to write() so far (Linux /proc/self/io), or None elsewhere."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+# --- Measurement ---
+class DiscardOutput:
+    """Swallows the agents' prints without a write() per line, so they don't count as bytes written."""
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+class SleepRecorder:
+    """Replaces time.sleep so the 60s free-tier throttles cost nothing, but are still reported."""
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __call__(self, seconds):
+        self.seconds += seconds
+
+def measure_stage(name, func, workspace, sleep_recorder):
+    fakes.COUNTER.reset()
+    sleep_recorder.seconds = 0.0
+    tracemalloc.reset_peak()
+    start_mem = tracemalloc.get_traced_memory()[0]
+    start_written = bytes_written()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(DiscardOutput()):
+        func()
+    wall = time.perf_counter() - start
+    end_written = bytes_written()
+    peak = tracemalloc.get_traced_memory()[1] - start_mem
+    calls, nbytes = fakes.COUNTER.snapshot()
+    return {
+        "wall_s": round(wall, 4),
+        "peak_mb": round(max(peak, 0) / (1024 * 1024), 3),
+        "calls": calls,
+        "total_calls": sum(calls.values()),
+        "http_bytes": nbytes.get("http.get", 0),
+        "llm_chars": nbytes.get("llm.generate_content", 0),
+        "data_bytes": data_bytes(workspace),
+        "written_bytes": end_written - start_written if start_written is not None else None,
+        "simulated_wait_s": sleep_recorder.seconds,
+    }
+
+def run_scale(scale, stages, sleep_recorder):
+    server, base_url = fakes.start_page_server({})
+    workspace, pages = build_workspace(scale, base_url)
+    server.RequestHandlerClass.pages = pages
+    previous_cwd = os.getcwd()
+    results = {}
+    try:
+        os.chdir(workspace)
+        for name, func in stages:
+            results[name] = measure_stage(name, func, workspace, sleep_recorder)
+    finally:
+        os.chdir(previous_cwd)
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+def direct_command(process_commands):
+    """The cleanup_trigger.yml path: one PROMOTE for an album the Tidal stage just added."""
+    from library_index import load_library_index
+    def run():
+        albums = load_library_index()['playlist_albums'].get("AI Music Discovery", {})
+        album_id = next(iter(albums), None)
+        if album_id is None:
+            return
+        album = fakes.FAKE_CATALOG.albums[int(album_id)]
+        env = {"CLEANUP_ALBUM_ID": album_id, "CLEANUP_ACTION": "PROMOTE", "CLEANUP_ARTIST": album.artist.name, "CLEANUP_ALBUM": album.name}
+        with mock.patch.dict(os.environ, env):
+            process_commands()
+    return run
+
+def daemon_command():
+    """main_workflow.py --daemon: start the service, then one REMOVE through its local endpoint."""
+    import requests
+    from agent_service import AgentService, start_server
+    from library_index import load_library_index
+    def run():
+        albums = load_library_index()['playlist_albums'].get("AI Music Discovery", {})
+        album_id = next(iter(albums), None)
+        if album_id is None:
+            return
+        album = fakes.FAKE_CATALOG.albums[int(album_id)]
+        service = AgentService(run_workflow=lambda **kwargs: None)
+        server = start_server(service, port=0, poll_interval=0.01)
+        try:
+            form = {"album_id": album_id, "action_type": "REMOVE", "artist": album.artist.name, "album": album.name}
+            response = requests.post(f"http://127.0.0.1:{server.server_address[1]}/cleanup", json=form, timeout=30)
+            response.raise_for_status()
+        finally:
+            service.stop()
+            server.shutdown()
+            server.server_close()
+    return run
+
+def profile_batch():
+    """main_workflow.py --profiles with the original profile plus a stricter second listener."""
+    from profile_runner import run_batch
+    profiles = {"profiles": [
+        {"name": "default", "data_dir": "data"},
+        {"name": "second", "tidal_env_prefix": "TIDAL_SECOND_", "max_liked_albums_per_run": 2, "min_relevance_score": 85},
+    ]}
+    env = {f"TIDAL_SECOND_{k}": FAKE_ENV[f"TIDAL_{k}"] for k in ("TOKEN_TYPE", "ACCESS_TOKEN", "REFRESH_TOKEN", "EXPIRY_TIME")}
+    def run():
+        with open(os.path.join('config', 'profiles.json'), 'w') as f:
+            json.dump(profiles, f)
+        with mock.patch.dict(os.environ, env):
+            run_batch(workers=1)
+    return run
+
+def load_stages():
+    """Imports the agents with the stand-ins patched in. Returns [(stage_name, callable)]."""
+    from harvester_agent import harvest_new_albums
+    from analysis_agent import analyze_albums
+    from tidal_agent import take_tidal_actions
+    from cleanup_agent import process_commands
+    from discovery_agent import run_discovery
+    from reconcile_agent import reconcile
+    return [
+        ("harvest", harvest_new_albums),
+        ("analysis", analyze_albums),
+        ("tidal", take_tidal_actions),
+        ("cleanup", process_commands),
+        ("hitl", direct_command(process_commands)),
+        ("hitl_daemon", daemon_command()),
+        ("discovery", run_discovery),
+        ("reconcile", reconcile),
+        ("profiles", profile_batch()),
+    ]
+
+# --- Reporting ---
+def print_results(results):
+    for scale, stages in results.items():
+        print(f"\n=== Scale {scale} ===")
+        print(f"{'stage':<10} {'wall_s':>9} {'peak_mb':>9} {'calls':>7} {'http_kb':>9} {'llm_kchars':>11} {'data_kb':>9} {'written_kb':>11} {'wait_s':>8}")
+        for stage, m in stages.items():
+            print(f"{stage:<10} {m['wall_s']:>9.3f} {m['peak_mb']:>9.2f} {m['total_calls']:>7} "
+                  f"{m['http_bytes'] / 1024:>9.1f} {m['llm_chars'] / 1000:>11.1f} {m['data_bytes'] / 1024:>9.1f} "
+                  f"{(m['written_bytes'] or 0) / 1024:>11.1f} {m['simulated_wait_s']:>8.0f}")
+        for stage, m in stages.items():
+            top = ", ".join(f"{k}={v}" for k, v in sorted(m['calls'].items()))
+            print(f"  {stage} calls: {top or 'none'}")
+
+def print_scaling(results):
+    scales = list(results.keys())
+    if len(scales) < 2:
+        return
+    base = scales[0]
+    print(f"\n=== Scaling (relative to {base}) ===")
+    print(f"{'stage':<10} " + " ".join(f"{s + ' time':>14} {s + ' calls':>14}" for s in scales))
+    for stage in results[base]:
+        row = f"{stage:<10} "
+        for s in scales:
+            m, b = results[s][stage], results[base][stage]
+            t_ratio = m['wall_s'] / b['wall_s'] if b['wall_s'] else 0
+            c_ratio = m['total_calls'] / b['total_calls'] if b['total_calls'] else 0
+            row += f"{t_ratio:>13.1f}x {c_ratio:>13.1f}x "
+        print(row)
+
+def find_regressions(results, baseline):
+    """Returns (regressions, warnings): calls, bytes written and memory fail the run, wall time only warns."""
+    regressions, warnings = [], []
+    for scale, stages in results.items():
+        for stage, m in stages.items():
+            b = baseline.get(scale, {}).get(stage)
+            if not b:
+                continue
+            if m['wall_s'] > b['wall_s'] * (1 + TIME_TOLERANCE) and m['wall_s'] - b['wall_s'] > TIME_FLOOR_SECONDS:
+                warnings.append(f"{scale} {stage}: wall time {b['wall_s']:.3f}s -> {m['wall_s']:.3f}s")
+            written, b_written = m.get('written_bytes'), b.get('written_bytes')
+            if written is not None and b_written is not None and \
+                    written > b_written * (1 + WRITE_TOLERANCE) and written - b_written > WRITE_FLOOR_BYTES:
+                regressions.append(f"{scale} {stage}: bytes written {b_written / 1024:.1f}KB -> {written / 1024:.1f}KB")
+            if m['peak_mb'] > b['peak_mb'] * (1 + MEMORY_TOLERANCE) and m['peak_mb'] - b['peak_mb'] > MEMORY_FLOOR_MB:
+                regressions.append(f"{scale} {stage}: peak memory {b['peak_mb']:.2f}MB -> {m['peak_mb']:.2f}MB")
+            for op, count in m['calls'].items():
+                if count > b['calls'].get(op, 0):
+                    regressions.append(f"{scale} {stage}: {op} calls {b['calls'].get(op, 0)} -> {count}")
+    return regressions, warnings
+
+# --- Main Function ---
+def run_benchmarks(scales, update_baseline=False, json_path=None):
+    os.environ.update(FAKE_ENV)
+    sleep_recorder = SleepRecorder()
+    tracemalloc.start()
+    results = {}
+    with mock.patch('time.sleep', sleep_recorder), \
+         mock.patch('google.generativeai.GenerativeModel', fakes.StubGenerativeModel), \
+         mock.patch('tidalapi.Session', fakes.FakeSession):
+        stages = load_stages()
+        import tidal_agent
+        import cleanup_agent
+        with mock.patch.object(tidal_agent, 'Session', fakes.FakeSession), \
+             mock.patch.object(cleanup_agent, 'Session', fakes.FakeSession):
+            for scale in scales:
+                print(f"Benchmark: running {scale}x ...", file=sys.stderr)
+                results[f"{scale}x"] = run_scale(scale, stages, sleep_recorder)
+    tracemalloc.stop()
+
+    print_results(results)
+    print_scaling(results)
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {json_path}")
+
+    if update_baseline:
+        with open(BASELINE_FILE_PATH, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline updated: {BASELINE_FILE_PATH}")
+        return 0
+
+    try:
+        with open(BASELINE_FILE_PATH, 'r') as f:
+            baseline = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        print("\nNo baseline found. Run with --update-baseline to create one.")
+        return 0
+
+    regressions, warnings = find_regressions(results, baseline)
+    missing = [scale for scale in results if scale not in baseline]
+    if missing:
+        print(f"\nNo baseline for {', '.join(missing)}; those results were not compared.")
+    if warnings:
+        print(f"\n⚠️  {len(warnings)} stage(s) slower than baseline (wall time is not gated):")
+        for w in warnings:
+            print(f"  - {w}")
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) against baseline:")
+        for r in regressions:
+            print(f"  - {r}")
+        return 1
+    print("\n✅ No regressions against baseline.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for the music agent.")
+    parser.add_argument('--scales', default=",".join(str(s) for s in DEFAULT_SCALES),
+                        help="Comma-separated multipliers of the recorded source/album counts.")
+    parser.add_argument('--update-baseline', action='store_true', help="Store this run as the new baseline.")
+    parser.add_argument('--json', dest='json_path', help="Also write the raw results to this file.")
+    args = parser.parse_args()
+    sys.exit(run_benchmarks([int(s) for s in args.scales.split(',')], args.update_baseline, args.json_path))
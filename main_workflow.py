@@ -2,51 +2,117 @@
 # This part is a bit of a quirk but necessary
 import sys
 import os
+import argparse
+import contextlib
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'agents')))
 
 # --- Import Our Agents ---
 try:
     from harvester_agent import harvest_new_albums
     from analysis_agent import analyze_albums
-    from tidal_agent import take_tidal_actions
+    from tidal_agent import take_tidal_actions, add_trace_summary, RealTidalClient, AlbumPrefetcher
     from cleanup_agent import process_commands
+    from tracing import span, export_trace, reset as reset_trace
 except ImportError:
     print("Error: Could not import agents.")
     print("Make sure 'harvester_agent.py', 'analysis_agent.py', 'tidal_agent.py', and 'cleanup_agent.py' exist in the /agents folder.")
     sys.exit(1)
 
 # --- Main Workflow Function ---
-def run_full_workflow():
+def run_full_workflow(tidal_client=None, cleanup_client=None, http=None, tidal_lock=None, before_tidal=None, profile=None):
+    """
+    Runs the four stages for one profile (default: the original setup in data/). The other
+    optional arguments come from the daemon (--daemon): warm clients and HTTP pool, plus a
+    lock held only around the Tidal stages and the relevance model save, so HITL commands
+    aren't stuck behind harvest and analysis.
+    """
     print("==========================================")
     print("🚀 STARTING PERSONAL MUSIC AGENT WORKFLOW")
     print("==========================================")
+    reset_trace()
     
     try:
         # --- STAGE 1: HARVEST ---
         print("\n--- STAGE 1: HARVESTER AGENT ---")
-        harvest_new_albums()
+        with span("stage.harvest", "stage"):
+            harvest_new_albums(http)
         
         # --- STAGE 2: ANALYSIS ---
         print("\n--- STAGE 2: ANALYSIS AGENT ---")
-        analyze_albums()
+        if tidal_client is None:
+            try:
+                tidal_client = RealTidalClient(profile=profile)
+            except Exception as e:
+                print(f"Tidal unavailable, no lookups during analysis: {e}")
+        # Playlist candidates are searched on Tidal as Gemini streams them, during the 60s waits
+        prefetcher = AlbumPrefetcher(tidal_client, tidal_lock) if tidal_client else None
+        try:
+            with span("stage.analysis", "stage"):
+                # The model is saved under the same lock as HITL commands, which save it too
+                analyze_albums(on_album=prefetcher.submit if prefetcher else None, profile=profile, model_lock=tidal_lock)
+        finally:
+            if prefetcher:
+                prefetcher.close()
         
-        # --- STAGE 3: TIDAL ACTION ---
-        print("\n--- STAGE 3: TIDAL ACTION AGENT ---")
-        take_tidal_actions()
+        with tidal_lock or contextlib.nullcontext():
+            if before_tidal:
+                before_tidal()
 
-        # --- STAGE 4: CLEANUP & COMMANDS (NEW) ---
-        print("\n--- STAGE 4: CLEANUP & COMMAND AGENT ---")
-        process_commands()
+            # --- STAGE 3: TIDAL ACTION ---
+            print("\n--- STAGE 3: TIDAL ACTION AGENT ---")
+            with span("stage.tidal", "stage"):
+                take_tidal_actions(tidal_client, profile)
+
+            # --- STAGE 4: CLEANUP & COMMANDS (NEW) ---
+            print("\n--- STAGE 4: CLEANUP & COMMAND AGENT ---")
+            with span("stage.cleanup", "stage"):
+                process_commands(cleanup_client, profile)
         
     except Exception as e:
         print(f"\n--- !! WORKFLOW FAILED !! ---")
         print(f"An error occurred: {e}")
         # In the future, this could send you an email alert
         
+    export_trace()
+    add_trace_summary(profile)
+
     print("\n==========================================")
     print("✅ WORKFLOW COMPLETE")
     print("==========================================")
 
+def run_profiles_workflow(workers=None):
+    """Multi-profile batch (--profiles): one shared harvest, then stages 2-4 per profile in config/profiles.json."""
+    from profile_runner import run_batch, MAX_PARALLEL_PROFILES
+    print("==========================================")
+    print("🚀 STARTING MULTI-PROFILE MUSIC AGENT RUN")
+    print("==========================================")
+    reset_trace()
+    try:
+        run_batch(workers=workers or MAX_PARALLEL_PROFILES)
+    except Exception as e:
+        print(f"\n--- !! BATCH RUN FAILED !! ---")
+        print(f"An error occurred: {e}")
+    export_trace()
+
+    print("\n==========================================")
+    print("✅ MULTI-PROFILE RUN COMPLETE")
+    print("==========================================")
+
 # --- Run the script ---
 if __name__ == "__main__":
-    run_full_workflow()
+    parser = argparse.ArgumentParser(description="Personal music agent workflow.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Stay running: warm Tidal session and caches, scheduled runs, local HITL endpoint.")
+    parser.add_argument("--port", type=int, default=None, help="Daemon endpoint port (default: MUSIC_AGENT_PORT or 8765).")
+    parser.add_argument("--run-now", action="store_true", help="Daemon: run the workflow once at startup.")
+    parser.add_argument("--profiles", action="store_true",
+                        help="Run every profile in config/profiles.json, harvesting once for all of them.")
+    parser.add_argument("--profile-workers", type=int, default=None, help="Profiles run in parallel (1 = sequential, in-process).")
+    args = parser.parse_args()
+    if args.profiles:
+        run_profiles_workflow(args.profile_workers)
+    elif args.daemon:
+        from agent_service import serve, SERVICE_PORT
+        serve(run_full_workflow, port=args.port or SERVICE_PORT, run_now=args.run_now)
+    else:
+        run_full_workflow()